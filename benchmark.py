@@ -0,0 +1,32 @@
+import argparse
+import json
+
+from games.aigame.benchmark import compare, run_suite, REPEAT
+from games.aigame.map import QUARTER_SIZE
+
+parser = argparse.ArgumentParser(description="Time the engine's hot paths on synthetic game states")
+parser.add_argument("--units", type=int, nargs="+", default=[10, 1000, 10000], help="Unit counts to benchmark")
+parser.add_argument("--players", type=int, nargs="+", default=[2], help="Player counts to benchmark")
+parser.add_argument("--sizes", type=int, nargs="+", default=[QUARTER_SIZE],
+                    help="Map sizes to benchmark, as the side of the generated quarter")
+parser.add_argument("--repeat", type=int, default=REPEAT, help="Runs of each benchmark, the best is compared")
+parser.add_argument("--seed", type=int, default=0, help="Seed of the maps and the synthetic states")
+parser.add_argument("--output", default="benchmark.json", help="Where to write the results")
+parser.add_argument("--compare", default=None, help="Results of an earlier run to compare against")
+args = parser.parse_args()
+
+results = run_suite(args.units, args.players, args.sizes, args.repeat, args.seed)
+with open(args.output, 'w') as outfile:
+    json.dump(results, outfile, indent=2)
+
+for result in results['results']:
+    print(f"{result['name']:<28} units={result.get('units', '-'):<7} players={result.get('players', '-'):<3} "
+          f"size={result['size']:<4} best={result['best'] * 1000:10.3f}ms per_op={result['per_op'] * 1e6:10.2f}us")
+
+if args.compare:
+    with open(args.compare) as infile:
+        baseline = json.load(infile)
+    for row in compare(baseline, results):
+        print(f"{row['name']:<28} units={row['units'] or '-':<7} players={row['players'] or '-':<3} "
+              f"size={row['size']:<4} {row['baseline'] * 1000:10.3f}ms -> {row['current'] * 1000:10.3f}ms "
+              f"x{row['speedup']:.2f}")
@@ -6,8 +6,6 @@ import numpy as np
 
 from library import Bot
 
-RESOURCE_TYPES = [None, None, None, "wood", "metal"]
-
 
 class AIBot(Bot):
 
@@ -29,30 +27,33 @@ class AIBot(Bot):
 
     def on_move_start(self):
         self.log("move start!")
+        gatherers, destinations = [], []
         for unit in self.myunits:
             if unit.collect_amount > 0:
                 # print(unit, self.gather_assignments, file=sys.stderr)
                 if unit not in self.gather_assignments:
                     self.gather_assignments[unit] = min(self.balance, key=self.balance.get)
 
-                for position in unit.nearest_nodes():
-                    # print(self.map[tuple(position)], file=sys.stderr)
-                    if self.map[tuple(position)] == RESOURCE_TYPES.index(self.gather_assignments[unit]):
-                        unit.move(position)
-                        break
+                for position in unit.nearest_nodes(self.gather_assignments[unit]):
+                    gatherers.append(unit)
+                    destinations.append(position)
+                    break
             elif unit.attack > 0:
                 for enemy in sorted(self.enemyunits,
                                     key=lambda e: np.hypot(*(np.array(unit.position) - np.array(e.position)))):
                     unit.move(enemy.position)
                     break
 
+        self.move_toward(gatherers, destinations)
         self.end_move()
 
     def on_collect_start(self):
         self.log("collect start!", len(self.units))
+        collected = set()  # Each tile can only be collected once per round
         for unit in self.myunits:
             if unit.collect_amount > 0:
-                if self.map[tuple(unit.position)] in (3, 4):
+                if self.map[tuple(unit.position)] in (3, 4) and tuple(unit.position) not in collected:
+                    collected.add(tuple(unit.position))
                     unit.collect()
 
         self.end_collect()
@@ -77,10 +78,11 @@ class AIBot(Bot):
 # except Exception as e:
 #     open(f'asdasd-{aib.player_id}.out', 'w').write(str(e))
 
-try:
-    bot = AIBot(logging_events=('in', 'out'))
-    bot.run()
-except Exception:
-    traceback.print_exc()
-finally:
-    bot.sock.close()
+if __name__ == "__main__":
+    try:
+        bot = AIBot(logging_events=('in', 'out'))
+        bot.run()
+    except Exception:
+        traceback.print_exc()
+    finally:
+        bot.sock.close()
@@ -8,15 +8,12 @@ import numpy as np
 
 from library import Bot
 
-RESOURCE_TYPES = [None, None, None, "wood", "metal"]
-
 
 class AIBot(Bot):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.gather_assignments = {}
-        self.node_assignments = {}
         self.enemy_assignments = defaultdict(list)
         self.attack_assignments = {}
 
@@ -47,24 +44,22 @@ class AIBot(Bot):
     def on_move_start(self):
         self.log("move start!")
         # print({u.id: u.collect_amount for u, ass in self.gather_assignments.items()}, file=sys.stderr)
+        gatherers, destinations = [], []
         for unit in self.myunits:
             if unit.collect_amount > 0:
                 # print(unit, self.gather_assignments, file=sys.stderr)
                 if unit.id not in self.gather_assignments:
                     self.gather_assignments[unit.id] = [min(self.balance, key=lambda x: sum(1 for res,_ in self.gather_assignments.values() if x == res)), None]
 
+                if not self.gather_assignments[unit.id][1]:
+                    node = self.resources.nearest(unit.position, 1, self.gather_assignments[unit.id][0], unclaimed=True)[0, 0]
+                    if node >= 0:
+                        self.resources.claim(unit.id, node)
+                        self.gather_assignments[unit.id][1] = tuple(self.resources.nodes[node].tolist())
+
                 if self.gather_assignments[unit.id][1]:
-                    unit.move(self.gather_assignments[unit.id][1])
-                    continue
-
-                for position in unit.nearest_nodes():
-                    # print(self.map[tuple(position)], file=sys.stderr)
-                    if tuple(position) not in self.node_assignments and \
-                            self.map[tuple(position)] == RESOURCE_TYPES.index(self.gather_assignments[unit.id][0]):
-                        unit.move(position)
-                        self.node_assignments[tuple(position)] = unit.id
-                        self.gather_assignments[unit.id][1] = tuple(position)
-                        break
+                    gatherers.append(unit)
+                    destinations.append(self.gather_assignments[unit.id][1])
             elif unit.attack > 0:
                 target = self.attack_assignments.get(unit.id)
                 if target and target not in self._units:
@@ -87,13 +82,16 @@ class AIBot(Bot):
                         unit.move(enemy.position)
                         break
 
+        self.move_toward(gatherers, destinations)
         self.end_move()
 
     def on_collect_start(self):
         self.log("collect start!", len(self.units))
         for unit in self.myunits:
             if unit.collect_amount > 0:
-                if self.map[tuple(unit.position)] in (3, 4):
+                # Only collect on the unit's own node, others may be passing over a node claimed by another gatherer
+                assignment = self.gather_assignments.get(unit.id)
+                if assignment and assignment[1] == tuple(unit.position):
                     print(f"Collecting unit {unit.id}", file=sys.stderr)
                     unit.collect()
 
@@ -118,7 +116,7 @@ class AIBot(Bot):
                 any(ratio[x] / sum(ratio.values()) > counts[x] / sum(counts.values()) for x in counts) or \
                 (sum(counts.values()) < 100) or \
                 (len(self.myunits) < 2 * len(self.enemyunits)):
-            if self.myunits and counts['gatherer'] >= len(list(self.myunits[0].nearest_nodes())):
+            if self.myunits and counts['gatherer'] >= len(self.resources):
                 utype = min(
                     {'attacker': 1},
                     key=lambda x: ratio[x] / (sum(ratio.values())) <= counts[x] / (sum(counts.values()) or 1)
@@ -148,10 +146,11 @@ class AIBot(Bot):
 # except Exception as e:
 #     open(f'asdasd-{aib.player_id}.out', 'w').write(str(e))
 
-try:
-    bot = AIBot(logging_events=('in', 'out'))
-    bot.run()
-except Exception:
-    traceback.print_exc()
-finally:
-    bot.sock.close()
+if __name__ == "__main__":
+    try:
+        bot = AIBot(logging_events=('in', 'out'))
+        bot.run()
+    except Exception:
+        traceback.print_exc()
+    finally:
+        bot.sock.close()
@@ -0,0 +1,58 @@
+import threading
+import time
+
+
+class PartBarrier(object):
+    """
+    Completion barrier for a single part of a round.
+
+    The engine opens the barrier for a (turn, part) before it sends `part_start`,
+    then waits on it. Every `end_<part>` that arrives marks the sender as finished and
+    the waiting engine is woken as soon as the last player is done, instead of polling.
+    Arrivals for any other (turn, part) are stale and ignored, so no per-turn state is kept.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.key = None
+        self.started = None
+        self.finished = {}
+        self.expected = ()
+
+    def open(self, turn: int, part: str, players) -> None:
+        """Start waiting for the given part. Resets all state from the previous part."""
+        with self._cond:
+            self.key = (turn, part)
+            self.started = time.monotonic()
+            self.finished = {}
+            self.expected = tuple(player.player_id for player in players)
+
+    def snapshot(self) -> tuple:
+        with self._cond:
+            return self.key, self.started, dict(self.finished), self.expected
+
+    def restore(self, snapshot: tuple) -> None:
+        with self._cond:
+            self.key, self.started, finished, self.expected = snapshot
+            self.finished = dict(finished)
+
+    def arrive(self, player_id: int, turn: int, part: str) -> None:
+        """Mark a player as finished with a part. Called from the input reader."""
+        with self._cond:
+            if (turn, part) != self.key or player_id in self.finished:
+                return
+            self.finished[player_id] = time.monotonic() - self.started
+            if all(pid in self.finished for pid in self.expected):
+                self._cond.notify_all()
+
+    def wait(self, timeout: float) -> dict:
+        """
+        Block until every player has finished the part or the timeout passes.
+
+        :return: Seconds each player took to finish the part, None for players who timed out
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: all(pid in self.finished for pid in self.expected), timeout)
+            durations = {pid: self.finished.get(pid) for pid in self.expected}
+            self.key = None
+        return durations
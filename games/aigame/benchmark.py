@@ -0,0 +1,245 @@
+"""
+Micro-benchmarks of the engine's hot paths on synthetic game states.
+
+`synthetic_game` builds an AIGame with any number of players, units and map size directly,
+without launching bots or playing rounds: every player is an in-process bot that does nothing.
+`run_suite` times state serialization, the dispatch of every part type, raycasts, range
+queries, map generation and the dead unit sweep on such games, and returns the timings as
+JSON-ready dicts so runs on different commits can be compared with `compare`.
+
+Anything a benchmark changes is put back from a snapshot between repeats, outside the timing.
+The engine's per command logging is written to /dev/null while timing, but still paid for.
+"""
+import contextlib
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Callable, List
+
+import numpy as np
+
+from library import Bot
+from library.passability import PassabilityMap, raycast
+from library.protocol import PARTS
+
+from .game import AIGame
+from .map import METAL, OPEN, QUARTER_SIZE, WOOD, generate_map
+from .unit_costs import unit_costs, unit_stats
+
+REPEAT = 5
+SEGMENTS = 1000  # segments per raycast benchmark
+QUERIES = 100  # units queried per range query benchmark
+ON_RESOURCES = 0.1  # share of units placed on resource tiles, so there is something to collect
+DEAD = 0.1  # share of units killed before the dead unit sweep
+SPAWNS = 10  # units each player buys in the spawn benchmark
+
+
+class IdleBot(Bot):
+    """In-process bot that never sends a command"""
+
+
+def synthetic_game(units: int, players: int = 2, size: int = QUARTER_SIZE, seed: int = 0) -> AIGame:
+    """
+    A game with `units` units spread over the open tiles of a generated map, split evenly between
+    players and unit types, ready for a part to be dispatched. Part of the units stand on resource tiles.
+    """
+    rng = np.random.RandomState(seed)
+    game = AIGame([IdleBot] * players, map_seed=seed, record_replay=False, profile=False)
+    game.map = generate_map(seed, size)
+    game.passability = PassabilityMap(game.map)
+    game.costs = unit_costs
+    game.unit_stats = unit_stats
+    game.turn = 0
+
+    last = len(game.map) - 1
+    for player in game.players:
+        player.home = tuple(rng.randint(0, last + 1, 2).tolist())
+        player.balance = {name: 10 ** 9 for name in player.balance}
+
+    open_tiles = np.argwhere(game.map == OPEN)
+    resource_tiles = np.argwhere(np.isin(game.map, (WOOD, METAL)))
+    on_resources = rng.random_sample(units) < ON_RESOURCES
+    positions = open_tiles[rng.randint(len(open_tiles), size=units)]
+    positions[on_resources] = resource_tiles[rng.randint(len(resource_tiles), size=on_resources.sum())]
+
+    types = list(unit_stats)
+    for index, position in enumerate(positions):
+        unit = game.create_unit(game.players[index % players], types[index // players % len(types)])
+        unit.position = position
+    return game
+
+
+def _commands(game: AIGame, part: str, rng: np.random.RandomState) -> dict:
+    """A valid set of commands for a part, per player id, as the bots would send them"""
+    store = game.store
+    rows = store.rows()
+    commands = {player.player_id: [] for player in game.players}
+
+    if part == "attack":
+        firsts, seconds = game.spatial.pairs_within(float(store.attack_range[rows].max(initial=0)))
+        attackers = np.concatenate([firsts, seconds])
+        targets = np.concatenate([seconds, firsts])
+        distance = np.hypot(*(store.position[attackers] - store.position[targets]).T)
+        valid = (store.owner[attackers] != store.owner[targets]) & (distance <= store.attack_range[attackers])
+        valid &= store.attack[attackers] > 0
+        attackers, targets = attackers[valid], targets[valid]
+        _, first = np.unique(attackers, return_index=True)
+        for attacker, target in zip(attackers[first].tolist(), targets[first].tolist()):
+            commands[int(store.owner[attacker])].append(
+                dict(command='attack', unit=int(store.id[attacker]), target=int(store.id[target])))
+
+    elif part == "move":
+        positions = store.position[rows]
+        destinations = np.clip(positions + rng.randint(-20, 21, positions.shape), 0, len(game.map) - 1)
+        diff = destinations - positions
+        distance = np.hypot(*diff.T)
+        speed = store.speed[rows]
+        scale = np.where(distance > speed, speed / np.maximum(distance, 1), 1)
+        ends = (positions + diff * scale[:, None]).astype(int)
+        clear = game.passability.are_clear(positions, ends)
+        for row, destination in zip(rows[clear].tolist(), destinations[clear].tolist()):
+            commands[int(store.owner[row])].append(dict(command='move', unit=int(store.id[row]), destination=destination))
+
+    elif part == "collect":
+        positions = store.position[rows]
+        on_resource = np.isin(game.map[positions[:, 0], positions[:, 1]], (WOOD, METAL))
+        rows = rows[on_resource]
+        # Each player can only collect each tile once
+        keys = np.column_stack([store.owner[rows], store.position[rows]])
+        _, first = np.unique(keys, axis=0, return_index=True)
+        for row in rows[np.sort(first)].tolist():
+            commands[int(store.owner[row])].append(dict(command='collect', unit=int(store.id[row])))
+
+    else:
+        for player in game.players:
+            commands[player.player_id] = [dict(command='spawn', unit_type=unit_type)
+                                          for unit_type in list(unit_costs) * (SPAWNS // len(unit_costs))]
+    return commands
+
+
+def measure(function: Callable, setup: Callable = None, repeat: int = REPEAT) -> dict:
+    """Time `function` `repeat` times, calling `setup` untimed before each run"""
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return dict(repeat=repeat, best=min(times), median=float(np.median(times)), mean=float(np.mean(times)))
+
+
+@contextlib.contextmanager
+def _quiet():
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def bench_game(units: int, players: int, size: int, repeat: int = REPEAT, seed: int = 0) -> List[dict]:
+    """Every benchmark that runs on a game state, for one game configuration"""
+    with _quiet():
+        game = synthetic_game(units, players, size, seed)
+    rng = np.random.RandomState(seed)
+    start = game.snapshot()
+    params = dict(units=units, players=players, size=size)
+    results = []
+
+    def record(name, ops, timing):
+        results.append(dict(name=name, **params, ops=ops, **timing, per_op=timing['best'] / max(ops, 1)))
+
+    record("get_state", units, measure(game.get_state, repeat=repeat))
+    record("get_part_state", units, measure(lambda: game.get_part_state(0, "attack"), repeat=repeat))
+    for protocol in ("json", "binary"):
+        # Encodings are cached on the part state, so every run encodes a fresh one
+        record(f"encode_part_start.{protocol}", units, measure(
+            lambda: game.part_state.encoded_for(protocol), lambda: game.get_part_state(0, "attack"), repeat))
+
+    for part in PARTS:
+        game.restore(start)
+        commands = _commands(game, part, rng)
+
+        def setup():
+            game.restore(start)
+            game.passability._cache.clear()
+            for player in game.players:
+                player.action_buffer[game.turn][part].extend(commands[player.player_id])
+
+        with _quiet():
+            record(f"dispatch.{part}", sum(map(len, commands.values())),
+                   measure(lambda: game.round.dispatch_actions(part), setup, repeat))
+    game.restore(start)
+
+    sample = [game.get_unit(uid) for uid in rng.choice(game.store.ids(), min(QUERIES, units), replace=False).tolist()]
+    record("units_within", len(sample), measure(
+        lambda: [list(unit.units_within(unit.view_range)) for unit in sample], repeat=repeat))
+
+    def kill():
+        game.restore(start)
+        rows = game.store.rows()
+        game.store.health[rows[rng.random_sample(len(rows)) < DEAD]] = 0
+
+    with _quiet():
+        record("remove_dead", int(units * DEAD), measure(game.remove_dead, kill, repeat))
+
+    game.close()
+    return results
+
+
+def bench_map(size: int, repeat: int = REPEAT, seed: int = 0) -> List[dict]:
+    """Benchmarks that only depend on the map"""
+    results = []
+    timing = measure(lambda: generate_map(seed, size), repeat=repeat)
+    results.append(dict(name="generate_map", size=size, ops=1, **timing, per_op=timing['best']))
+
+    tiles = generate_map(seed, size)
+    rng = np.random.RandomState(seed)
+    starts = rng.randint(0, len(tiles), (SEGMENTS, 2))
+    ends = np.clip(starts + rng.randint(-30, 31, starts.shape), 0, len(tiles) - 1)
+    timing = measure(lambda: [raycast(start, end) for start, end in zip(starts, ends)], repeat=repeat)
+    results.append(dict(name="raycast", size=size, ops=SEGMENTS, **timing, per_op=timing['best'] / SEGMENTS))
+    passability = PassabilityMap(tiles)
+    timing = measure(lambda: passability.are_clear(starts, ends), repeat=repeat)
+    results.append(dict(name="are_clear", size=size, ops=SEGMENTS, **timing, per_op=timing['best'] / SEGMENTS))
+    return results
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__)).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_suite(unit_counts=(10, 1000, 10000), player_counts=(2,), sizes=(QUARTER_SIZE,), repeat: int = REPEAT,
+              seed: int = 0) -> dict:
+    """Run every benchmark for every combination of unit count, player count and map size"""
+    results = []
+    for size in sizes:
+        results += bench_map(size, repeat, seed)
+        for players in player_counts:
+            for units in unit_counts:
+                print(f"Benchmarking {units} units, {players} players, map size {size}")
+                results += bench_game(units, players, size, repeat, seed)
+
+    meta = dict(commit=_commit(), time=time.time(), python=sys.version.split()[0], numpy=np.__version__,
+                platform=platform.platform(), seed=seed, repeat=repeat)
+    return dict(meta=meta, results=results)
+
+
+def _key(result: dict) -> tuple:
+    return result['name'], result.get('units'), result.get('players'), result['size']
+
+
+def compare(baseline: dict, current: dict) -> List[dict]:
+    """Best times of the benchmarks both runs have in common, with how many times faster the current run is"""
+    before = {_key(result): result for result in baseline['results']}
+    rows = []
+    for result in current['results']:
+        old = before.get(_key(result))
+        if old is not None:
+            rows.append(dict(zip(('name', 'units', 'players', 'size'), _key(result)),
+                             baseline=old['best'], current=result['best'], speedup=old['best'] / result['best']))
+    return rows
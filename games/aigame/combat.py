@@ -0,0 +1,59 @@
+import numpy as np
+
+
+def resolve_attacks(game, owners, attackers, targets) -> None:
+    """
+    Validate and apply a whole part's attack commands at once.
+
+    Commands are given as parallel arrays of (owning player id, attacking unit id, target unit id),
+    in the order they would have been dispatched one at a time. Ownership, the one attack per
+    round limit and range are all checked in bulk. If any command is invalid, every command before it
+    is applied and the same error the one-at-a-time dispatch would have raised is raised for it.
+    """
+    store = game.store
+    owners = np.asarray(owners, dtype=np.int64)
+    attackers = np.asarray(attackers, dtype=np.int64)
+    targets = np.asarray(targets, dtype=np.int64)
+    if not len(attackers):
+        return
+
+    arows = store.rows_of(attackers)
+    trows = store.rows_of(targets)
+    missing_attacker = arows < 0
+    missing_target = trows < 0
+    arows_safe = np.where(missing_attacker, 0, arows)
+    trows_safe = np.where(missing_target, 0, trows)
+
+    not_owned = store.owner[arows_safe] != owners
+    own_unit = store.owner[arows_safe] == store.owner[trows_safe]
+    # An attacker is spent by its first command of the part, or by an attack earlier in the round
+    first = np.zeros(len(arows), dtype=bool)
+    first[np.unique(arows, return_index=True)[1]] = True
+    already = store.attacked_this_round[arows_safe] | ~first
+    distance = np.hypot(*(store.position[arows_safe] - store.position[trows_safe]).T)
+    out_of_range = distance > store.attack_range[arows_safe]
+
+    # In the order the one-at-a-time checks happen
+    checks = [missing_attacker, not_owned, missing_target, own_unit, already, out_of_range]
+    invalid = np.zeros(len(arows), dtype=bool)
+    for check in checks:
+        invalid |= check
+    count = int(np.argmax(invalid)) if invalid.any() else len(arows)
+
+    np.add.at(store.health, trows[:count], -store.attack[arows[:count]])
+    store.attacked_this_round[arows[:count]] = True
+
+    if count == len(arows):
+        return
+
+    # Raise the error for the first invalid command, with the same message as before
+    if missing_attacker[count]:
+        raise KeyError(int(attackers[count]))
+    actor = game.get_unit(int(attackers[count]))
+    if not_owned[count]:
+        player = game.players[int(owners[count])]
+        game.get_unit(int(attackers[count]), player)
+    if missing_target[count]:
+        raise KeyError(int(targets[count]))
+    target = game.get_unit(int(targets[count]))
+    game.round.dispatch_attack(actor, target)
@@ -0,0 +1,318 @@
+import contextlib
+import functools
+import importlib.util
+import os
+import sys
+
+import gym
+import numpy as np
+from gym import spaces
+
+from library import Bot
+from library.protocol import PARTS, RESOURCES
+
+from .game import AIGame, ROUND_COUNT
+from .map import METAL, QUARTER_SIZE, WOOD
+from .unit_costs import unit_costs, unit_stats
+
+MAX_UNITS = 256  # unit slots in an observation, units past this are left out
+MAX_SPAWNS = 4  # units of each type the agent can buy in one spawn part
+UNIT_FEATURES = ('mine', 'type', 'health', 'attack', 'defense', 'speed', 'attack_range', 'collect_amount', 'x', 'y')
+# Opponent when none is given, found next to the games package rather than on the path
+EXAMPLE_BOT = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                           "example_bot2.py")
+
+
+def example_opponent() -> type:
+    """The AIBot of example_bot2.py, imported by path so it doesn't depend on the working directory"""
+    module = sys.modules.get("example_bot2")
+    if module is None:
+        spec = importlib.util.spec_from_file_location("example_bot2", EXAMPLE_BOT)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules["example_bot2"] = module
+    return module.AIBot
+
+
+class AgentBot(Bot):
+    """
+    Stands in for the agent inside the game. It plays nothing by itself: `AIGameEnv.step`
+    sends its commands and ends its parts. The environment observes the engine's state
+    directly, so the bot doesn't keep its own copy of it.
+    """
+    delta = True
+
+    def _update_state(self, newstate, delta=False):
+        pass
+
+
+class AIGameEnv(gym.Env):
+    """
+    Gym environment where one agent plays an AIGame against scripted bots.
+
+    Every bot, the agent included, runs in this process, so there are no sockets or
+    subprocesses between steps. Each step is one part of a round: the action holds the
+    agent's commands for the current part, the game carries out every player's commands
+    and the observation is the state at the start of the next part.
+
+    Observation (dict of arrays):
+    - units: one row of UNIT_FEATURES per unit the agent can see in id order, zero padded to `max_units`
+    - mask: which rows of `units` hold a unit
+    - balances: every player's balance of each resource, the agent's first (zero for opponents under fog of war)
+    - part: index of the current part in PARTS
+
+    Action, either a list of command dicts as a library bot would send them, or a dict of arrays
+    of which only the current part's entry is used. Arrays refer to units by observation row:
+    - attack: for each row, 1 + the row of the unit to attack, 0 to not attack
+    - move: for each row, the tile to move towards, negative to stay
+    - collect: for each row, whether to collect
+    - spawn: how many units of each type to buy
+    Array commands that the game would reject (other players' units, out of range or blocked
+    tiles, unaffordable units) are left out. Any command the game still rejects ends the
+    episode, with the error in `info`.
+
+    The reward is the change in the agent's lead in total balance over the best opponent,
+    which is what the winner is judged on, so over an episode it adds up to the final lead.
+    The map of the current episode is `env.map`.
+    """
+    metadata = {'render.modes': []}
+
+    def __init__(self, opponents=None, map_seed=None, map_cache=None,
+                 max_units=MAX_UNITS, rounds=ROUND_COUNT, fog=False, line_of_sight=False, verbose=False):
+        if opponents is None:
+            opponents = (example_opponent(),)
+        self.opponents = list(opponents)
+        self.map_seed = map_seed
+        self.map_cache = map_cache
+        self.max_units = max_units
+        self.rounds = rounds
+        self.fog = fog
+        self.line_of_sight = line_of_sight
+        self.verbose = verbose
+        self.num_players = len(self.opponents) + 1
+
+        self.game = None
+        self.map = None
+        self.slot_ids = np.empty(0, dtype=np.int64)
+        self.turn = 0
+        self.part = 0
+        self.lead = 0
+        self.done = True
+        self.np_random = np.random.RandomState()
+
+        self.unit_types = list(unit_stats)
+        size = 2 * QUARTER_SIZE - 1
+
+        self.observation_space = spaces.Dict(dict(
+            units=spaces.Box(-np.inf, np.inf, (max_units, len(UNIT_FEATURES)), dtype=np.float32),
+            mask=spaces.MultiBinary(max_units),
+            balances=spaces.Box(-np.inf, np.inf, (self.num_players, len(RESOURCES)), dtype=np.float32),
+            part=spaces.Discrete(len(PARTS)),
+        ))
+        self.action_space = spaces.Dict(dict(
+            attack=spaces.MultiDiscrete([max_units + 1] * max_units),
+            move=spaces.Box(-1, size - 1, (max_units, 2), dtype=np.int64),
+            collect=spaces.MultiBinary(max_units),
+            spawn=spaces.MultiDiscrete([MAX_SPAWNS + 1] * len(self.unit_types)),
+        ))
+
+    def seed(self, seed=None):
+        self.np_random = np.random.RandomState(seed)
+        return [seed]
+
+    def _output(self):
+        # The engine and the bots log every part, which would swamp any training run
+        if self.verbose:
+            return contextlib.nullcontext()
+        devnull = open(os.devnull, 'w')
+        stack = contextlib.ExitStack()
+        stack.enter_context(devnull)
+        stack.enter_context(contextlib.redirect_stdout(devnull))
+        stack.enter_context(contextlib.redirect_stderr(devnull))
+        return stack
+
+    def _new_game(self) -> AIGame:
+        map_seed = self.map_seed
+        if map_seed is None:
+            map_seed = self.np_random.randint(2 ** 31 - 1)
+        return AIGame([AgentBot] + self.opponents, map_seed=map_seed, map_cache=self.map_cache, record_replay=False,
+                      fog=self.fog, line_of_sight=self.line_of_sight, profile=False)
+
+    @property
+    def agent(self) -> AgentBot:
+        return self.game.players[0].bot
+
+    def reset(self):
+        with self._output():
+            if self.game is not None:
+                self.game.close()
+            self.game = self._new_game()
+            self.game.running = True
+            self.game.init_game()
+            self.map = self.game.map
+            self.turn, self.part = 0, 0
+            self.game.turn = self.turn
+            self.game.round.start_round(self.turn)
+            self.game.round.start_part(self.turn, PARTS[self.part])
+        self.done = False
+        self.lead = self._lead()
+        return self._observation()
+
+    def step(self, action):
+        if self.done:
+            raise RuntimeError("The episode is over, call reset() first")
+
+        info = {}
+        with self._output():
+            try:
+                for command in self._commands(action):
+                    self.agent.send(command)
+                getattr(self.agent, f"end_{PARTS[self.part]}")()
+                self.game.round.finish_part(self.turn, PARTS[self.part])
+                self._advance()
+            except (RuntimeError, KeyError) as error:
+                # The engine raises KeyError for commands naming units that don't exist
+                info['error'] = str(error) if isinstance(error, RuntimeError) else f"No unit or field {error}"
+                self.done = True
+
+        lead = self._lead()
+        reward, self.lead = lead - self.lead, lead
+        if self.done:
+            info['winner'] = self.game.judge_winner().player_id
+            self.game.close()
+        return self._observation(), float(reward), self.done, info
+
+    def _advance(self):
+        """Move on to the next part, and the next round after the last part"""
+        self.part += 1
+        if self.part == len(PARTS):
+            self.game.round.end_round(self.turn)
+            self.turn, self.part = self.turn + 1, 0
+            if self.turn == self.rounds:
+                self.done = True
+                return
+            self.game.turn = self.turn
+            self.game.round.start_round(self.turn)
+        self.game.round.start_part(self.turn, PARTS[self.part])
+
+    def snapshot(self) -> tuple:
+        """
+        Capture the match between two steps, for search or rollback. Only the game is captured,
+        scripted opponents keep whatever they remember of the match.
+        """
+        return self.game.snapshot(), self.turn, self.part, self.lead, self.done
+
+    def restore(self, snapshot: tuple) -> dict:
+        """Put the match back to a snapshot and return the observation at that point"""
+        game_snapshot, self.turn, self.part, self.lead, self.done = snapshot
+        self.game.restore(game_snapshot)
+        return self._observation()
+
+    def close(self):
+        if self.game is not None:
+            with self._output():
+                self.game.close()
+            self.game = None
+
+    def _lead(self) -> int:
+        totals = [sum(player.balance.values()) for player in self.game.players]
+        return totals[0] - max(totals[1:])
+
+    def _observation(self) -> dict:
+        view = self.game.part_state.for_player(0)
+        records = view.units[:self.max_units]
+        self.slot_ids = records['id']
+        count = len(records)
+
+        units = np.zeros((self.max_units, len(UNIT_FEATURES)), dtype=np.float32)
+        units[:count, 0] = records['owner'] == 0
+        units[:count, 1] = records['type']
+        for column, name in enumerate(UNIT_FEATURES[2:-2], 2):
+            units[:count, column] = records[name]
+        units[:count, -2:] = records['position']
+
+        mask = np.zeros(self.max_units, dtype=np.int8)
+        mask[:count] = 1
+        # Balances as of the start of the part, under fog of war only the agent's own is known
+        balances = np.array(
+            [[view.players.get(player.player_id, {}).get(name, 0) for name in RESOURCES] for player in self.game.players],
+            dtype=np.float32,
+        )
+        return dict(units=units, mask=mask, balances=balances, part=self.part)
+
+    def _commands(self, action) -> list:
+        """The agent's commands for the current part"""
+        if isinstance(action, (list, tuple)):
+            return list(action)
+
+        part = PARTS[self.part]
+        store = self.game.store
+        rows = store.rows_of(self.slot_ids)
+        mine = (rows >= 0) & (store.owner[rows] == 0)
+        slots = np.arange(len(self.slot_ids))
+
+        if part == "spawn":
+            commands = []
+            balance = dict(self.game.players[0].balance)
+            for unit_type, count in zip(self.unit_types, np.asarray(action['spawn']).tolist()):
+                cost = unit_costs[unit_type]
+                for _ in range(count):
+                    if any(balance.get(name, 0) < amount for name, amount in cost.items()):
+                        break
+                    balance = {name: balance[name] - amount for name, amount in cost.items()}
+                    commands.append(dict(command='spawn', unit_type=unit_type))
+            return commands
+
+        if part == "attack":
+            targets = np.asarray(action['attack'])[:len(slots)] - 1
+            valid = mine & (targets >= 0) & (targets < len(slots))
+            slots, targets = slots[valid], targets[valid]
+            attackers, victims = rows[slots], rows[targets]
+            in_range = np.hypot(*(store.position[attackers] - store.position[victims]).T) <= store.attack_range[attackers]
+            valid = (victims >= 0) & (store.owner[victims] != 0) & (store.attack[attackers] > 0) & in_range
+            return [dict(command='attack', unit=int(self.slot_ids[slot]), target=int(self.slot_ids[target]))
+                    for slot, target in zip(slots[valid].tolist(), targets[valid].tolist())]
+
+        if part == "move":
+            destinations = np.asarray(action['move'])[:len(slots)]
+            size = len(self.map)
+            valid = mine & (destinations >= 0).all(axis=1) & (destinations < size).all(axis=1)
+            slots, destinations = slots[valid], destinations[valid]
+            # Where each unit would end up, the same way Unit.move works it out
+            positions = store.position[rows[slots]]
+            diff = destinations - positions
+            distance = np.hypot(*diff.T)
+            speed = store.speed[rows[slots]]
+            scale = np.where(distance > speed, speed / np.maximum(distance, 1), 1)
+            ends = (positions + diff * scale[:, None]).astype(int)
+            valid = (distance > 0) & self.game.passability.are_clear(positions, ends)
+            return [dict(command='move', unit=int(self.slot_ids[slot]), destination=destination)
+                    for slot, destination in zip(slots[valid].tolist(), destinations[valid].tolist())]
+
+        collect = np.asarray(action['collect'])[:len(slots)].astype(bool)
+        slots = slots[mine & collect]
+        positions = store.position[rows[slots]]
+        on_resource = np.isin(self.map[positions[:, 0], positions[:, 1]], (WOOD, METAL))
+        slots, positions = slots[on_resource], positions[on_resource]
+        # Each tile can only be collected once a round
+        _, first = np.unique(positions, axis=0, return_index=True)
+        return [dict(command='collect', unit=int(self.slot_ids[slot])) for slot in slots[np.sort(first)].tolist()]
+
+
+def make_env(seed=None, **kwargs) -> AIGameEnv:
+    env = AIGameEnv(**kwargs)
+    env.seed(seed)
+    return env
+
+
+def make_vec_env(num_envs: int, seed: int = None, **kwargs) -> gym.vector.AsyncVectorEnv:
+    """
+    Run `num_envs` AIGameEnv matches, each in its own subprocess, with observations batched
+    into arrays with a leading env dimension. Finished matches are reset automatically.
+    Actions are given as one action per env.
+    """
+    env_fns = [
+        functools.partial(make_env, None if seed is None else seed + index, **kwargs)
+        for index in range(num_envs)
+    ]
+    return gym.vector.AsyncVectorEnv(env_fns)
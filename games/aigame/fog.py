@@ -0,0 +1,41 @@
+import numpy as np
+
+from library.passability import PassabilityMap
+from library.protocol import NO_VIEW_RANGE
+
+
+def visibility(store: 'UnitStore', spatial: 'SpatialGrid', num_players: int,
+               passability: PassabilityMap = None) -> np.ndarray:
+    """
+    Which units each player can see, as a (player, store row) mask.
+
+    Players see their own units, and any other unit within the view range of one of theirs.
+    Given a passability map, the line between the two must also be clear of impassable tiles.
+    Candidate pairs come from the spatial grid and are checked all at once, units without a
+    view range see nothing but themselves.
+    """
+    size = store.size
+    owners = store.owner[:size].astype(np.int64)
+    view_range = store.view_range[:size]
+    visible = np.zeros((num_players, size), dtype=bool)
+    alive = np.flatnonzero(store.alive[:size])
+    visible[owners[alive], alive] = True
+
+    radius = view_range[alive].max(initial=NO_VIEW_RANGE)
+    if radius <= 0:
+        return visible
+
+    first, second = spatial.pairs_within(radius)
+    # Every pair works both ways, the first unit might see the second and the second the first
+    observers = np.concatenate([first, second])
+    targets = np.concatenate([second, first])
+    distance = np.hypot(*(store.position[observers] - store.position[targets]).T)
+    sees = (owners[observers] != owners[targets]) & (distance <= view_range[observers])
+    observers, targets = observers[sees], targets[sees]
+
+    if passability is not None and len(observers):
+        clear = passability.are_clear(store.position[observers], store.position[targets])
+        observers, targets = observers[clear], targets[clear]
+
+    visible[owners[observers], targets] = True
+    return visible
@@ -1,63 +1,125 @@
 import json
+import os
 import socket
 import time
-from collections import Counter
+from collections import Counter, deque
 from copy import deepcopy
 from typing import Dict
 
 import numpy as np
 
-from .map import generate_map
-from .player import Player
+from library.passability import PassabilityMap
+from library.protocol import encode_map
+
+from ..core import Game
+from .barrier import PartBarrier
+from .fog import visibility
+from .map import load_map
+from .metrics import MatchMetrics
+from .partstate import PartState
+from .player import Player, LocalPlayer
+from .replay import ReplayWriter, KEYFRAME_INTERVAL
 from . import units
 from .round import GameRound
+from .server import GameServer
+from .snapshot import GameSnapshot
+from .spatial import SpatialGrid
+from .store import UnitStore
 
-from .unit_costs import unit_costs, unit_stats
+from .unit_costs import fog_view_ranges, unit_costs, unit_stats
 from .utils import NpEncoder
 
 ROUND_COUNT = 200
 
 
-class AIGame(object):
+class AIGame(Game):
     _units: Dict[int, 'units.Unit']
     _groups: Dict[int, 'units.Group']
     turncount: int = 0
     map: np.array = None
+    passability: PassabilityMap = None
     unit_counter: int = 0
     group_counter: int = 0
     costs: dict = None
     player_id: int = None
     players = ()
+    part_state = None  # The state sent at the start of the last part, deltas are built against it
     round = None
     running = False
     turn = None
 
-    def __init__(self, paths):
+    def __init__(self, paths, replay_path=None, keyframe_interval=KEYFRAME_INTERVAL, map_seed=None,
+                 map_cache=None, port=6667, transport="tcp", record_replay=True,
+                 fog=False, line_of_sight=False, profile=None, metrics_path=None, keep_history=0):
+        '''
+        Args:
+            paths (list): Bot file paths, or library.Bot subclasses to run in this process
+            record_replay (bool): Write a replay of the match, turned off for training environments
+            map_cache (str): Directory generated maps are cached in, None for the MAP_CACHE_DIR environment variable
+            fog (bool): Fog of war, players are only sent the units within view of their own
+            line_of_sight (bool): Under fog of war, impassable tiles block the view as well
+            port (int): Port the bots connect to, 0 picks a free one so several matches can share a host
+            transport (str): How bots connect, "tcp", "unix" (domain socket) or "socketpair" (inherited socket)
+            profile (bool): Record per part timings and command counts, None to turn it on when ENABLE_PROFILER=1
+            metrics_path (str): Where the metrics are written at the end of the match, as `<path>.json` and
+                `<path>.prom`. Nothing is written without it
+            keep_history (int): Rounds played with `step` that `step_back` can undo, the oldest are dropped first.
+                0 takes no snapshots, None keeps every round
+        '''
         self._units = {}
+        self.store = UnitStore(unit_stats)
+        self.spatial = SpatialGrid(self.store)
         self._groups = {}
-        self.output = dict(init=None, turns=[])
+        self.fog = fog
+        self.line_of_sight = line_of_sight
+        self.history = deque(maxlen=keep_history)  # Snapshots from before each round played with `step`, for `step_back`
+        self.replay = None
+        if record_replay:
+            self.replay = ReplayWriter(replay_path or f"output-{time.time()}.jsonl.gz", keyframe_interval)
+        if profile is None:
+            profile = os.environ.get("ENABLE_PROFILER") == "1"
+        self.metrics = MatchMetrics(profile)
+        self.metrics_path = metrics_path
 
         self.np_random = np.random.RandomState()  # This is a random state that will be the basis for our initialization
+        self.map_seed = map_seed
+        self.map_cache = map_cache if map_cache is not None else os.environ.get("MAP_CACHE_DIR")
         self.num_players = len(paths)
+        self.barrier = PartBarrier()
 
-        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server.bind(('localhost', 6667))
-        self.server.listen(self.num_players)
+        # Bots given as library.Bot subclasses instead of paths run in this process, without the server
+        self.server = None
+        remote = [i for i, path in enumerate(paths) if not isinstance(path, type)]
+        if remote:
+            self.server = GameServer(remote, port=port, transport=transport, unit_types=self.store.type_names)
+            self.server.start()
 
         corners = [(0, 0), ()]
-        self.players = [Player(self, i, self.np_random, paths[i]) for i in range(self.num_players)]
+        # All bots are launched before any is waited on, so they start up and connect concurrently
+        self.players = [
+            (LocalPlayer if isinstance(paths[i], type) else Player)(self, i, self.np_random, paths[i])
+            for i in range(self.num_players)
+        ]
+        if self.server:
+            try:
+                self.server.wait_for_players([player for player in self.players if not isinstance(player, LocalPlayer)])
+            except Exception:
+                self.close()
+                raise
         self.round = GameRound(self, self.players, self.np_random)
 
     def run(self):
         self.running = True
-        self.init_game()
-        for self.turn in range(ROUND_COUNT):
-            print(self.turn)
-            self.step(self.turn)
+        try:
+            self.init_game()
+            for self.turn in range(ROUND_COUNT):
+                print(self.turn)
+                self.step(self.turn)
 
-        for player in self.players:
-            player.send_winner(self.judge_winner())
-            player.proc.kill()
+            for player in self.players:
+                player.send_winner(self.judge_winner())
+        finally:
+            self.close()
 
         print(time.time(), "THE WINNER IS", self.judge_winner())
         print(time.time(), "PLAYERS: ", *self.players)
@@ -66,9 +128,34 @@ class AIGame(object):
         print(Counter(unit.type for unit in self.units))
         print('p0 units', Counter(unit.type for unit in self.players[0].units))
         print('p1 units', Counter(unit.type for unit in self.players[1].units))
-        with open(f"output-{time.time()}.json", 'w') as outfile:
-            json.dump(self.output, outfile, cls=NpEncoder)
+        return self.results()
+
+    def close(self):
+        ''' Shut down the bots and the server and finish the replay. Safe to call more than once.
+        '''
         self.running = False
+        if self.server:
+            self.server.close()
+        for player in self.players:
+            player.stop()
+        if self.replay:
+            self.replay.close()
+        if self.metrics_path is not None:
+            self.metrics.write(self.metrics_path, match=self.results() if self.map is not None else None)
+
+    def results(self) -> dict:
+        ''' Summary of the match so far
+        '''
+        winner = self.judge_winner()
+        return dict(
+            winner=winner.player_id,
+            winner_path=winner.file_path,
+            paths=[player.file_path for player in self.players],
+            balances={player.player_id: dict(player.balance) for player in self.players},
+            units={player.player_id: len(self.store.owned_by(player.player_id)) for player in self.players},
+            rounds=0 if self.turn is None else self.turn + 1,
+            map_seed=self.map_seed,
+        )
 
     def init_game(self):
         ''' Initialize players and state
@@ -79,27 +166,121 @@ class AIGame(object):
                 (dict): The first state in one game
                 (int): Current player's id
         '''
-        self.map = generate_map(self.np_random)
+        if self.map_seed is None:
+            self.map_seed = self.np_random.randint(2 ** 31 - 1)
+        self.map = load_map(self.map_seed, self.map_cache)
+        self._encoded_maps = {}
+        self.passability = PassabilityMap(self.map)
         self.costs = unit_costs
         self.unit_stats = unit_stats
+        if self.fog:
+            self.unit_stats = {name: dict(stats, view_range=fog_view_ranges[name]) for name, stats in unit_stats.items()}
 
         corners = [(0, 0), (len(self.map)-1, len(self.map)-1), (0, len(self.map)-1), (len(self.map)-1, 0)]
-        # Initialize the map for each player
         for player, home in zip(self.players, corners):
             player.home = home
+        # Initialize the map for each player
+        for player in self.players:
             player.send_init(self.map, self.num_players, self.costs)
-            player.readthread.start()
             # player.errorthread.start()
 
-        self.output['init'] = dict(map=self.map.tolist(), num_players=self.num_players, unit_costs=self.costs)
+        if self.replay:
+            self.replay.write_init(dict(map=self.map.tolist(), map_seed=self.map_seed, num_players=self.num_players,
+                                        unit_costs=self.costs))
 
         print(self.map)
 
+    def encoded_map(self, encoding: str):
+        ''' The map encoded for the initialize message, encoded only once per encoding
+        '''
+        if encoding not in self._encoded_maps:
+            self._encoded_maps[encoding] = encode_map(self.map, encoding)
+        return self._encoded_maps[encoding]
+
     def step(self, round_number: int):
+        if self.history.maxlen != 0:
+            self.history.append(self.snapshot())
         self.round.proceed_round(round_number)
 
+    def step_back(self):
+        ''' Restore the game to before the last round played with `step`
+
+        Returns:
+            (bool): False if there is no round to go back from
+        '''
+        if not self.history:
+            return False
+        self.restore(self.history.pop())
+        return True
+
+    def get_player_num(self):
+        return self.num_players
+
+    def snapshot(self) -> GameSnapshot:
+        ''' Capture the state of the game, cheap enough to take many times a round
+        '''
+        return GameSnapshot(
+            store=self.store.snapshot(),
+            groups=[(group.id, group.owner.player_id, np.array(group.position), [unit.id for unit in group.members])
+                    for group in self._groups.values()],
+            balances=[dict(player.balance) for player in self.players],
+            actions=[{turn: {part: list(commands) for part, commands in parts.items() if commands}
+                      for turn, parts in player.action_buffer.items()} for player in self.players],
+            barrier=self.barrier.snapshot(),
+            unit_counter=self.unit_counter,
+            group_counter=self.group_counter,
+            turn=self.turn,
+            part_state=self.part_state,
+            random_state=self.np_random.get_state(),
+        )
+
+    def restore(self, snapshot: GameSnapshot):
+        ''' Put the game back to a snapshot. The same snapshot can be restored any number of times.
+        Bots are sent the full state at the next part unless the last state they got is the snapshot's.
+        '''
+        self.store.restore(snapshot.store)
+        self.spatial.rebuild()
+        self._units = {uid: units.Unit(self, uid) for uid in self.store.index}
+        self._groups = {}
+        for gid, owner, position, members in snapshot.groups:
+            group = units.Group(self, gid, self.players[owner], np.array(position))
+            for uid in members:
+                group.members.append(self._units[uid])
+                self._units[uid]._group = group
+            self._groups[gid] = group
+
+        for player, balance, actions in zip(self.players, snapshot.balances, snapshot.actions):
+            player.balance = dict(balance)
+            player.action_buffer.clear()
+            for turn, parts in actions.items():
+                for part, commands in parts.items():
+                    player.action_buffer[turn][part].extend(commands)
+        self.barrier.restore(snapshot.barrier)
+        self.unit_counter = snapshot.unit_counter
+        self.group_counter = snapshot.group_counter
+        self.turn = snapshot.turn
+        self.part_state = snapshot.part_state
+        self.np_random.set_state(snapshot.random_state)
+
     def remove_unit(self, unit):
-        del self._units[unit.id]
+        self.remove_units([unit.id])
+
+    def remove_units(self, ids):
+        for uid in ids:
+            self.spatial.remove(self.store.index[uid])
+            del self._units[uid]
+        self.store.remove(ids)
+
+    def remove_dead(self):
+        """Remove every unit which has run out of health, found in one masked pass over the store"""
+        dead = self.store.dead()
+        rows = self.store.rows_of(dead)
+        types = np.array(self.store.type_names)[self.store.type[rows]]
+        owners = self.store.owner[rows]
+        for owner, utype, uid in zip(owners.tolist(), types.tolist(), dead.tolist()):
+            print("Killing unit", owner, utype, uid)
+        self.remove_units(dead.tolist())
+        return dead
 
     @property
     def units(self):
@@ -110,7 +291,9 @@ class AIGame(object):
         return list(self._groups.values())
 
     def create_unit(self, player, type):
-        u = units.Unit(self, self.unit_counter, player, type, position=player.home, **self.unit_stats[type])
+        row = self.store.add(self.unit_counter, player.player_id, type, player.home, self.unit_stats[type])
+        self.spatial.insert(row, player.home)
+        u = units.Unit(self, self.unit_counter)
         self._units[self.unit_counter] = u
         self.unit_counter += 1
         return u
@@ -138,8 +321,37 @@ class AIGame(object):
 
     def get_state(self):
         state = {
-            'units': [unit.serialize() for unit in self.units],
+            'units': self.store.serialize(),
             'groups': [group.serialize() for group in self.groups],
-            'players': {player.player_id: player.balance for player in self.players}
+            'players': {player.player_id: dict(player.balance) for player in self.players}
         }
         return state
+
+    def get_part_state(self, turn: int, part: str) -> PartState:
+        """Build the state shared by the replay and every player for the start of a part"""
+        rows = self.store.rows()
+        previous = self.part_state
+        self.part_state = PartState(
+            turn, part,
+            units=self.store.records(rows),
+            groups=[group.serialize() for group in self.groups],
+            players={player.player_id: dict(player.balance) for player in self.players},
+            unit_types=self.store.type_names,
+            previous=previous,
+        )
+
+        if self.fog:
+            visible = visibility(self.store, self.spatial, self.num_players,
+                                 self.passability if self.line_of_sight else None)[:, rows]
+            self.part_state.views = {
+                player.player_id: PartState(
+                    turn, part,
+                    units=self.part_state.units[visible[player.player_id]],
+                    groups=[group for group in self.part_state.groups if group['owner'] == player.player_id],
+                    players={player.player_id: self.part_state.players[player.player_id]},
+                    unit_types=self.store.type_names,
+                    previous=previous.for_player(player.player_id) if previous is not None else None,
+                )
+                for player in self.players
+            }
+        return self.part_state
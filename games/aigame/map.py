@@ -1,84 +1,121 @@
-import noise
+import os
+import tempfile
+
 import numpy as np
 
+# Bump whenever generation changes so stale cached maps are not reused.
+# 2: maps come from the NumPy noise below and the seed's own RandomState, they differ from the noise package era
+MAP_VERSION = 2
+
+OPEN, IMPASSABLE, WOOD, METAL = 0, 1, 3, 4
+IMPASSABLE_THRESHOLD = 1.0  # Noise values at or above this are impassable
+RESOURCE_NODES = 10  # Nodes of each resource placed on a quarter of the map
+QUARTER_SIZE = 100  # Side of the generated quarter, the mirrored map's side is 2 * QUARTER_SIZE - 1
+
+# Unit gradient vectors, picked per lattice point from the permutation table
+GRADIENTS = np.array([(np.cos(a), np.sin(a)) for a in np.arange(8) * np.pi / 4])
+
+
+def fade(t):
+    return t * t * t * (t * (t * 6 - 15) + 10)
+
+
+def perlin2(x: np.ndarray, y: np.ndarray, perm: np.ndarray, repeatx: int, repeaty: int) -> np.ndarray:
+    """Single octave of 2D Perlin noise, evaluated for every point of the x and y arrays at once"""
+    xi = np.floor(x).astype(np.int64)
+    yi = np.floor(y).astype(np.int64)
+    xf = x - xi
+    yf = y - yi
+
+    def gradient_dot(cx, cy, dx, dy):
+        h = perm[(perm[(cx % repeatx) % 256] + (cy % repeaty)) % 256] % len(GRADIENTS)
+        return GRADIENTS[h, 0] * dx + GRADIENTS[h, 1] * dy
+
+    u = fade(xf)
+    v = fade(yf)
+    bottom = (1 - u) * gradient_dot(xi, yi, xf, yf) + u * gradient_dot(xi + 1, yi, xf - 1, yf)
+    top = (1 - u) * gradient_dot(xi, yi + 1, xf, yf - 1) + u * gradient_dot(xi + 1, yi + 1, xf - 1, yf - 1)
+    return (1 - v) * bottom + v * top
 
-def norm(x):
-    # if x < -0.15:
-    #     return 1
-    # elif x < 0:
-    #     return 1
-    if x < 1.0:
-        return 0
 
-    # if -.2 < x < 0.2:
-    #     return 0
-    # if -.2 <= x <= -.3:
-    #     return 2
-    # if .2 >= x >= .3:
-    #     return 3
-    #
-    # return 1
+def noise_field(shape, scale, octaves, persistence, lacunarity, base) -> np.ndarray:
+    """
+    Fractal noise over the whole grid. Octaves are summed and normalized to the total amplitude
+    like `noise.pnoise2`, but the gradients and the permutation drawn from `base` are this
+    module's own, so the values differ from pnoise2's for the same parameters.
+    """
+    perm = np.random.RandomState(base).permutation(256)
+    x, y = np.indices(shape) / scale
 
+    total = np.zeros(shape)
+    frequency, amplitude, max_amplitude = 1.0, 1.0, 0.0
+    for _ in range(octaves):
+        total += amplitude * perlin2(
+            x * frequency, y * frequency, perm,
+            max(int(shape[0] * frequency), 1), max(int(shape[1] * frequency), 1)
+        )
+        max_amplitude += amplitude
+        frequency *= lacunarity
+        amplitude *= persistence
 
-vf = np.vectorize(norm)
+    return total / max_amplitude
 
 
-def mirror(seq):
-    output = list(seq[::-1])
-    output.extend(seq[1:])
-    return output
+def mirror(world: np.ndarray, axis: int = 0) -> np.ndarray:
+    """Reflect the world along an axis around its first row/column, sharing the edge"""
+    return np.concatenate([np.flip(world, axis), np.delete(world, 0, axis)], axis=axis)
 
 
 def chunkify(world, chunksize):
-    shape = world.shape
-
-    chunks = np.zeros((shape[0] // chunksize, shape[1] // chunksize))
-    for x in range(shape[0] // chunksize):
-        for y in range(shape[1] // chunksize):
-            chunk = world[x * chunksize: x * chunksize + chunksize, y * chunksize: y * chunksize + chunksize]
-
-            chunks[x][y] = chunk.mean()
-
-    return chunks
-
-
-def generate_map(np_random):
-    # shape = (64, 64)
-    # scale = 100.0
-    # octaves = 2
-    # persistence = .8
-    # lacunarity = 5
-
-    shape = 100, 100
-    scale = 100.0
-    octaves = 12
-    persistence = 0.5
-    lacunarity = 2.0
-
-    d = np_random.randint(0, 100)
-    world = np.zeros(shape)
-    for i in range(shape[0]):
-        for j in range(shape[1]):
-            world[i][j] = noise.pnoise2(
-                i / scale,
-                j / scale,
-                octaves=octaves,
-                persistence=persistence,
-                lacunarity=lacunarity,
-                repeatx=shape[0],
-                repeaty=shape[1],
-                base=d
-            )
-
-    # world *= scale
-    # world += 50
-    indices = np.random.choice(world.shape[1] * world.shape[0], replace=False,
-                               size=int(world.shape[1] * world.shape[0] * 0.2))
-    # print(np.indices(world.shape))
-    world = vf(world)
-
-    for i in range(10):
-        world[np.random.choice(world.shape[0]), np.random.choice(world.shape[1])] = 3
-    for i in range(10):
-        world[np.random.choice(world.shape[0]), np.random.choice(world.shape[1])] = 4
-    return np.array(mirror([mirror(sublist) for sublist in world]))
+    shape = world.shape[0] // chunksize, world.shape[1] // chunksize
+    world = world[:shape[0] * chunksize, :shape[1] * chunksize]
+    return world.reshape(shape[0], chunksize, shape[1], chunksize).mean(axis=(1, 3))
+
+
+def generate_map(seed: int, size: int = QUARTER_SIZE, scale: float = 100.0, octaves: int = 12,
+                 persistence: float = 0.5, lacunarity: float = 2.0):
+    """
+    Generate a quarter of the map from noise, place resource nodes on it and mirror it into
+    a (2 * size - 1) square map so every corner is identical.
+    The map is fully determined by the seed and the generator parameters. Layouts are not the
+    ones the noise package based generator made before MAP_VERSION 2, that one drew the nodes
+    from the global random state and could not be reproduced.
+    """
+    rng = np.random.RandomState(seed)
+    shape = size, size
+
+    d = rng.randint(0, 100)
+    world = noise_field(shape, scale, octaves, persistence, lacunarity, base=d)
+    world = np.where(world < IMPASSABLE_THRESHOLD, OPEN, IMPASSABLE)
+
+    world[rng.choice(shape[0], RESOURCE_NODES), rng.choice(shape[1], RESOURCE_NODES)] = WOOD
+    world[rng.choice(shape[0], RESOURCE_NODES), rng.choice(shape[1], RESOURCE_NODES)] = METAL
+    return mirror(mirror(world, 0), 1)
+
+
+def load_map(seed: int, cache_dir: str = None, **params) -> np.ndarray:
+    """
+    Get the map for a seed, generating it only if it isn't already in the cache directory.
+
+    Cached maps are stored as .npy files keyed by the seed and generator parameters and are
+    loaded memory mapped and read only. Without a cache directory the map is always generated.
+    """
+    if cache_dir is None:
+        return generate_map(seed, **params)
+
+    key = "-".join(f"{name}={value}" for name, value in sorted(params.items()))
+    path = os.path.join(cache_dir, f"map-v{MAP_VERSION}-{seed}{'-' + key if key else ''}.npy")
+    if not os.path.exists(path):
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write to a temporary file first so concurrent matches never load a half written map
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".npy")
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                np.save(file, generate_map(seed, **params))
+            os.replace(tmp_path, path)
+        finally:
+            # Only left behind if writing failed
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    return np.load(path, mmap_mode='r')
@@ -0,0 +1,176 @@
+import bisect
+import contextlib
+import json
+import time
+from collections import defaultdict
+from typing import Dict, Tuple
+
+# Upper bounds, in seconds, of the histogram buckets
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PREFIX = "aigame_"
+
+HELP = {
+    'build_state_seconds': "Time to capture the state at the start of a part",
+    'encode_seconds': "Time to encode the part_start messages of a part, over every player",
+    'response_seconds': "Time from a part starting to a player sending its end_<part>",
+    'dispatch_seconds': "Time to carry out every command of a part",
+    'round_seconds': "Wall time of a whole round",
+    'commands_total': "Commands received",
+    'timeouts_total': "Parts a player did not end within the action timeout",
+}
+
+
+class Histogram(object):
+    """Counts of observed values per bucket, along with their count, sum, min and max"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last bucket holds everything above the highest bound
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th quantile, the maximum for the last bucket"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        return dict(
+            count=self.count,
+            sum=self.sum,
+            mean=self.sum / self.count if self.count else None,
+            min=self.min,
+            max=self.max,
+            p50=self.quantile(0.5),
+            p90=self.quantile(0.9),
+            p99=self.quantile(0.99),
+            buckets=dict(zip([*map(str, self.buckets), "+Inf"], self.counts)),
+        )
+
+
+class MatchMetrics(object):
+    """
+    Timings and counts for one match, per round and part.
+
+    Enabled with AIGame(profile=True), or with ENABLE_PROFILER=1 when profile isn't given.
+    Histograms and counters are keyed by a metric name and labels (part, player). Every part also
+    gets a record of its own timings, so slow parts can be traced back to the engine or to a bot.
+    `write` exports a JSON summary and the same metrics in the Prometheus text format, AIGame
+    calls it at the end of the match when given a metrics_path. When disabled every method does nothing.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.histograms: Dict[Tuple[str, tuple], Histogram] = {}
+        self.counters: Dict[Tuple[str, tuple], int] = defaultdict(int)
+        self.parts = []
+        self.written = False
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> Tuple[str, tuple]:
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        if key not in self.histograms:
+            self.histograms[key] = Histogram()
+        self.histograms[key].observe(value)
+
+    def count(self, name: str, amount: int = 1, **labels) -> None:
+        if self.enabled:
+            self.counters[self._key(name, labels)] += amount
+
+    @contextlib.contextmanager
+    def timer(self, name: str, record: bool = True, **labels):
+        """Time the body of a with block into a histogram, and into the current part's record"""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe(name, elapsed, **labels)
+            if record:
+                self.record(name, elapsed, add=True)
+
+    def start_part(self, turn: int, part: str) -> None:
+        if self.enabled:
+            self.parts.append(dict(turn=turn, part=part, encode_seconds=0.0))
+
+    def record(self, name: str, value, add: bool = False) -> None:
+        """Set (or add to) a value in the current part's record"""
+        if not self.enabled or not self.parts:
+            return
+        record = self.parts[-1]
+        record[name] = record.get(name, 0) + value if add else value
+
+    def current(self, name: str, default=None):
+        """A value from the current part's record"""
+        return self.parts[-1].get(name, default) if self.enabled and self.parts else default
+
+    def summary(self) -> dict:
+        histograms = defaultdict(list)
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            histograms[name].append(dict(labels=dict(labels), **histogram.summary()))
+        counters = defaultdict(list)
+        for (name, labels), value in sorted(self.counters.items()):
+            counters[name].append(dict(labels=dict(labels), value=value))
+        return dict(histograms=histograms, counters=counters, parts=self.parts)
+
+    def prometheus(self) -> str:
+        """Every histogram and counter in the Prometheus text exposition format"""
+        def label_text(labels, **extra):
+            pairs = [*labels, *extra.items()]
+            return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}" if pairs else ""
+
+        lines = []
+        for name in sorted({name for name, _ in self.histograms}):
+            lines.append(f"# HELP {PREFIX}{name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {PREFIX}{name} histogram")
+            for (metric, labels), histogram in sorted(self.histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip([*map(str, histogram.buckets), "+Inf"], histogram.counts):
+                    cumulative += count
+                    lines.append(f"{PREFIX}{name}_bucket{label_text(labels, le=bound)} {cumulative}")
+                lines.append(f"{PREFIX}{name}_sum{label_text(labels)} {histogram.sum}")
+                lines.append(f"{PREFIX}{name}_count{label_text(labels)} {histogram.count}")
+
+        for name in sorted({name for name, _ in self.counters}):
+            lines.append(f"# HELP {PREFIX}{name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {PREFIX}{name} counter")
+            for (metric, labels), value in sorted(self.counters.items()):
+                if metric == name:
+                    lines.append(f"{PREFIX}{name}{label_text(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str, match: dict = None) -> None:
+        """Write `<path>.json` and `<path>.prom`, once per match"""
+        if not self.enabled or self.written:
+            return
+        self.written = True
+        with open(f"{path}.json", 'w') as file:
+            json.dump(dict(self.summary(), match=match), file, indent=1, default=str)
+        with open(f"{path}.prom", 'w') as file:
+            file.write(self.prometheus())
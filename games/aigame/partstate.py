@@ -0,0 +1,148 @@
+import itertools
+
+import numpy as np
+
+from library.protocol import encode_part_delta, encode_part_start, unit_dicts
+
+from .utils import json_dumps
+
+
+# Every part state gets its own key. A delta applies on top of the part state whose key is its
+# `previous_key`, turn and part alone don't identify a state once the game can be restored to a snapshot.
+_keys = itertools.count()
+
+
+class PartState(object):
+    """
+    The game state at the start of a part.
+
+    It is built once per part and shared by the replay and every player, so the state is
+    only serialized and encoded once no matter how many players there are. Units are captured
+    as packed records, which the binary protocol sends as they are.
+
+    Given the state of the previous part, it also holds the delta against it: the units that
+    spawned, changed or were removed, and the groups only if they changed. Only the previous
+    part's units and groups are kept, not the whole chain of states.
+
+    Under fog of war every player gets a view of its own, a PartState holding only what that
+    player can see, with deltas against the player's view of the previous part.
+    """
+
+    def __init__(self, turn: int, part: str, units: np.ndarray, groups: list, players: dict, unit_types: list,
+                 previous: 'PartState' = None):
+        self.turn = turn
+        self.part = part
+        self.units = units
+        self.groups = groups
+        self.players = players
+        self.unit_types = unit_types
+        self.key = next(_keys)
+        self.previous_key = None
+        if previous is not None:
+            self.previous_key = previous.key
+            self._previous = previous.units, previous.groups
+        self._state = None
+        self._encoded = None
+        self._binary = None
+        self._delta = None
+        self._delta_encoded = None
+        self._delta_binary = None
+        self.views = None  # Under fog of war, the PartState each player can see, by player id
+
+    def for_player(self, player_id: int) -> 'PartState':
+        """The state the given player is allowed to see"""
+        return self.views[player_id] if self.views is not None else self
+
+    @property
+    def state(self) -> dict:
+        """The state as sent by the JSON protocol"""
+        if self._state is None:
+            self._state = dict(units=unit_dicts(self.units, self.unit_types), groups=self.groups, players=self.players)
+        return self._state
+
+    @property
+    def message(self) -> dict:
+        return dict(type="part_start", turn=self.turn, part=self.part, state=self.state)
+
+    def local_message(self) -> dict:
+        """
+        The part_start message as an in-process bot would have decoded it: balances are keyed
+        by the player id as a string and copied, since the bot keeps and changes its own.
+        The unit and group lists are shared, bots only read them.
+        """
+        state = dict(self.state, players={str(pid): dict(balance) for pid, balance in self.state['players'].items()})
+        return dict(self.message, state=state)
+
+    @property
+    def encoded(self) -> bytes:
+        """The part_start message, encoded and framed, ready to be written to any player"""
+        if self._encoded is None:
+            self._encoded = json_dumps(self.message).encode() + b"\r\n"
+        return self._encoded
+
+    @property
+    def binary(self) -> bytes:
+        """The part_start message as a binary protocol frame"""
+        if self._binary is None:
+            self._binary = encode_part_start(self.turn, self.part, self.units, self.groups, self.players)
+        return self._binary
+
+    def encoded_for(self, protocol: str) -> bytes:
+        return self.binary if protocol == "binary" else self.encoded
+
+    @property
+    def delta(self) -> dict:
+        """
+        The units spawned, changed and removed since the previous part as records, and the groups
+        if they changed (None otherwise). Both unit arrays are in id order, so the units both parts
+        have line up and are compared record by record.
+        """
+        if self._delta is None:
+            if self.previous_key is None:
+                raise RuntimeError(f"Part {self.key} has no previous part to build a delta against")
+            previous_units, previous_groups = self._previous
+            kept = np.isin(self.units['id'], previous_units['id'], assume_unique=True)
+            still_alive = np.isin(previous_units['id'], self.units['id'], assume_unique=True)
+            current = self.units[kept]
+            self._delta = dict(
+                spawned=self.units[~kept],
+                changed=current[current != previous_units[still_alive]],
+                removed=previous_units['id'][~still_alive],
+                groups=self.groups if self.groups != previous_groups else None,
+            )
+            del self._previous
+        return self._delta
+
+    @property
+    def delta_message(self) -> dict:
+        delta = self.delta
+        state = dict(
+            spawned=unit_dicts(delta['spawned'], self.unit_types),
+            changed=unit_dicts(delta['changed'], self.unit_types),
+            removed=delta['removed'].tolist(),
+            players=self.players,
+        )
+        if delta['groups'] is not None:
+            state['groups'] = delta['groups']
+        return dict(type="part_start", turn=self.turn, part=self.part, delta=True, state=state)
+
+    def local_delta_message(self) -> dict:
+        """The delta part_start message as an in-process bot would have decoded it, see `local_message`"""
+        message = self.delta_message
+        players = {str(pid): dict(balance) for pid, balance in self.players.items()}
+        return dict(message, state=dict(message['state'], players=players))
+
+    def delta_encoded_for(self, protocol: str) -> bytes:
+        """The delta part_start message, encoded for the given protocol"""
+        if protocol == "binary":
+            if self._delta_binary is None:
+                delta = self.delta
+                self._delta_binary = encode_part_delta(
+                    self.turn, self.part, delta['spawned'], delta['changed'], delta['removed'],
+                    delta['groups'], self.players,
+                )
+            return self._delta_binary
+
+        if self._delta_encoded is None:
+            self._delta_encoded = json_dumps(self.delta_message).encode() + b"\r\n"
+        return self._delta_encoded
@@ -4,7 +4,9 @@ import queue
 import subprocess
 import sys
 import time
+import traceback
 from collections import deque, defaultdict
+from copy import deepcopy
 import select
 
 from games.aigame import units
@@ -13,6 +15,7 @@ import socket
 import threading
 
 from games.aigame.utils import json_dumps
+from library.protocol import encode_end_game
 
 
 class Player(object):
@@ -45,7 +48,14 @@ class Player(object):
         self.balance = {'wood': 20, 'metal': 20}
         self.send_buffer = deque()
         self.home = 0, 0
+        self.response_times = {}
+        self.last_part = None  # Key of the last part state this player was sent
 
+        self.start()
+
+    def start(self):
+        """Launch the player's bot. It connects to the game server on its own."""
+        file_path = self.file_path
         if file_path.endswith("py"):
             command = [sys.executable]
         elif file_path.endswith("jar"):
@@ -55,36 +65,52 @@ class Player(object):
         else:
             raise RuntimeError(f"Invalid file type: {file_path}")
 
+        server = self.game.server
         self.proc = subprocess.Popen(
-            command + [file_path, '6667'],
+            command + [file_path, server.address(self.player_id), str(self.player_id)],
+            pass_fds=server.inherited_fds(self.player_id),
             # stdout=subprocess.PIPE,
             # stdin=subprocess.PIPE,
             # stderr=subprocess.PIPE,
             # universal_newlines=True
         )
-        (self.sock, address) = self.game.server.accept()
-
-        self.turn_events: dict[dict[str, threading.Event]] = defaultdict(lambda: defaultdict(threading.Event))
-        self.readthread = threading.Thread(target=self.handle_input_daemon)
+        server.launched(self.player_id)
         # self.errorthread = threading.Thread(target=self.handle_error_daemon)
 
-    def handle_input_daemon(self):
-        try:
-            buffer = b""
-            while self.game.running:
-                new = self.sock.recv(1024)
-                if not new:
-                    return
-                buffer += new
-                while b"\n" in buffer:
-                    data, buffer = buffer.split(b"\n", 1)
-                    respvalue = json.loads(data)
-                    if not respvalue.get("command").startswith("end_"):
-                        self.action_buffer[respvalue['turn']][respvalue['part']].append(respvalue)
-                    else:
-                        self.turn_events[respvalue['turn']][respvalue.get("command").split("_")[1]].set()
-        except Exception as e:
-            raise RuntimeError(f"Invalid input from player {self.player_id}") from e
+    def stop(self):
+        """Shut down the player's bot"""
+        if self.proc.poll() is None:
+            self.proc.kill()
+            self.proc.wait()
+
+    def handle_message(self, respvalue: dict):
+        """Buffer a command read from this player's connection. Called from the server's event loop."""
+        if respvalue.get("command") == "hello":
+            return
+        if not respvalue.get("command").startswith("end_"):
+            self.action_buffer[respvalue['turn']][respvalue['part']].append(respvalue)
+        else:
+            self.game.barrier.arrive(self.player_id, respvalue['turn'], respvalue.get("command").split("_")[1])
+
+    @property
+    def protocol(self) -> str:
+        """The wire protocol this player's bot negotiated"""
+        return self.game.server.protocols.get(self.player_id, "json")
+
+    @property
+    def delta(self) -> bool:
+        """Whether this player's bot asked for delta part_start messages"""
+        return self.player_id in self.game.server.deltas
+
+    def wants_delta(self, part_state: 'PartState') -> bool:
+        """A delta can only be sent if the bot has the state it applies to, otherwise it gets a full snapshot"""
+        wants = self.delta and part_state.previous_key is not None and part_state.previous_key == self.last_part
+        self.last_part = part_state.key
+        return wants
+
+    def send(self, data: bytes):
+        """Send raw bytes to the player"""
+        self.game.server.send(self.player_id, data)
 
     def handle_error_daemon(self):
         while self.game.running:
@@ -99,60 +125,73 @@ class Player(object):
     def get_player_actions(players: list, eventtype: str, turn: int, timeout: int = 3):
         """Its a staticmethod so it can run for all players at once.
         Send end_move to mark end of move phase early
-        """
-
-        end = time.monotonic() + timeout
-        while time.monotonic() < end:
-            if all(player.turn_events[turn][eventtype].is_set() for player in players):
-                print("BREAKING OUT!")
-                break
-            time.sleep(0.001)
 
-        # print([{**player.turn_events[turn]} for player in players])
+        The barrier must have been opened for this part before part_start was sent.
+        Returns how long each player took to end the part (None if they timed out).
+        """
+        durations = players[0].game.barrier.wait(timeout)
 
         for player in players:
-            player.turn_events[eventtype].clear()
-        # print(time.monotonic(), end)
-        # print(players[0].action_buffer)
+            player.response_times[eventtype] = durations[player.player_id]
+        return durations
 
-    def send_part_start(self, turncount, eventtype):
-        gamestate = self.game.get_state()
-        resp = dict(type="part_start", turn=turncount, part=eventtype, state=gamestate)
+    def send_part_start(self, turncount, eventtype, part_state: 'PartState' = None):
+        if part_state is None:
+            part_state = self.game.get_part_state(turncount, eventtype)
 
+        part_state = part_state.for_player(self.player_id)
         # if self.sock.closed:
         #     raise RuntimeError("Pipe is closed!")
-        self.sock.send(
-            json_dumps(resp).encode() + b"\r\n"
-        )
+        start = time.perf_counter()
+        if self.wants_delta(part_state):
+            data = part_state.delta_encoded_for(self.protocol)
+        else:
+            data = part_state.encoded_for(self.protocol)
+        self.game.metrics.record('encode_seconds', time.perf_counter() - start, add=True)
+        self.send(data)
         # self.sock.flush()
 
     def send_winner(self, winner: 'Player'):
         # if self.sock.closed:
         #     raise RuntimeError("Pipe is closed!")
 
+        if self.protocol == "binary":
+            return self.send(encode_end_game(winner.player_id))
+
         resp = dict(winners=winner.player_id, type="end_game")
 
-        self.sock.send(
+        self.send(
             json_dumps(resp).encode() + b"\r\n"
         )
         # self.sock.flush()
 
-    def send_init(self, map, num_players, costs):
-        tmap = map.tolist()
-        resp = dict(
+    def init_message(self, map, num_players, costs) -> dict:
+        return dict(
             type="initialize",
-            map=tmap,
+            map=map,
             player_id=self.player_id,
             num_players=num_players,
             balance=self.balance,
             costs=costs,
-            home=list(self.home)
+            home=list(self.home),
+            homes={player.player_id: list(player.home) for player in self.game.players},
+            unit_stats=self.game.unit_stats,
+            protocol=self.protocol,
+            unit_types=self.game.store.type_names,
         )
 
+    @property
+    def map_encoding(self) -> str:
+        """How this player's bot asked for the map to be encoded, see `library.protocol.encode_map`"""
+        return self.game.server.map_encodings.get(self.player_id, "list")
+
+    def send_init(self, map, num_players, costs):
+        resp = self.init_message(self.game.encoded_map(self.map_encoding), num_players, costs)
+
         # if self.sock.closed:
         #     raise RuntimeError("Pipe is closed!")
 
-        self.sock.send(
+        self.send(
             json_dumps(resp).encode() + b"\r\n"
         )
         # self.sock.flush()
@@ -177,8 +216,84 @@ class Player(object):
 
     @property
     def units(self):
-        return [unit for unit in self.game.units if unit.owner == self]
+        return [self.game.get_unit(uid) for uid in self.game.store.owned_by(self.player_id).tolist()]
 
     @property
     def groups(self):
         return [group for group in self.game.group if group.owner == self]
+
+
+class LocalPlayer(Player):
+    """
+    A player whose bot is a `library.Bot` subclass running inside the engine's process.
+
+    Instead of encoded payloads the bot is handed the same messages as Python objects, and its
+    commands go straight to `handle_message`. Every message is given to the bot as a fresh
+    copy wherever the bot could modify it, so it behaves exactly as it would over a socket.
+    The bot runs synchronously when its part starts, so the action timeout doesn't apply.
+    A bot that raises is stopped, like a remote bot whose connection broke: the commands it sent
+    before are kept and every part after it is ended for it without commands.
+    """
+
+    def __init__(self, game, player_id, np_random, bot_class):
+        self.bot_class = bot_class
+        self.bot = None
+        self.crashed = False
+        super().__init__(game, player_id, np_random, bot_class.__name__)
+
+    @property
+    def protocol(self) -> str:
+        return "local"
+
+    @property
+    def delta(self) -> bool:
+        return self.bot.delta
+
+    def start(self):
+        self.bot = self.bot_class(handler=self.handle_message)
+
+    def stop(self):
+        self.bot.running = False
+
+    def _call(self, handler, *args) -> bool:
+        """Run one of the bot's handlers, stopping the bot if it raises. Returns whether it ran without error."""
+        if self.crashed:
+            return False
+        try:
+            handler(*args)
+            return True
+        except Exception:
+            traceback.print_exc()
+            print(f"{self} crashed in {handler.__name__}, its parts are ended without commands from now on")
+            self.crashed = True
+            self.stop()
+            return False
+
+    def send_init(self, map, num_players, costs):
+        # The bot shares the engine's map, read only like a map decoded from the wire
+        map = map.view()
+        map.flags.writeable = False
+        resp = self.init_message(map, num_players, deepcopy(costs))
+        resp['balance'] = dict(self.balance)
+        resp['homes'] = {str(pid): home for pid, home in resp['homes'].items()}
+        resp['unit_stats'] = deepcopy(resp['unit_stats'])
+        self._call(self.bot.on_initialize_raw, resp)
+
+    def send_part_start(self, turncount, eventtype, part_state: 'PartState' = None):
+        if not self.crashed:
+            if part_state is None:
+                part_state = self.game.get_part_state(turncount, eventtype)
+            part_state = part_state.for_player(self.player_id)
+            start = time.perf_counter()
+            if self.wants_delta(part_state):
+                message = part_state.local_delta_message()
+            else:
+                message = part_state.local_message()
+            self.game.metrics.record('encode_seconds', time.perf_counter() - start, add=True)
+            self._call(self.bot.on_part_start_raw, message)
+        if self.crashed:
+            # Nothing more will come from the bot, so the game doesn't wait out the part for it
+            self.game.barrier.arrive(self.player_id, turncount, eventtype)
+
+    def send_winner(self, winner: 'Player'):
+        self._call(self.bot.on_end_game_raw, dict(winners=winner.player_id, type="end_game"))
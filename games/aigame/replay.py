@@ -0,0 +1,112 @@
+import gzip
+import json
+from typing import Iterator, Tuple
+
+from .utils import json_dumps
+
+KEYFRAME_INTERVAL = 20  # parts between full states
+
+
+class ReplayWriter(object):
+    """
+    Streams the replay to disk as the match is played.
+
+    The replay is gzip compressed newline separated JSON. The first line holds the initial
+    payload, then every part gets one line: a full `keyframe` every `keyframe_interval` parts
+    and a `delta` holding only the changed units, removed unit ids, groups and balances in between.
+    Each line is flushed as it is written, so a crash keeps everything up to the last part.
+    Deltas are taken from the part state, which only keeps the previous part's units around.
+    """
+
+    def __init__(self, path: str, keyframe_interval: int = KEYFRAME_INTERVAL):
+        self.path = path
+        self.keyframe_interval = keyframe_interval
+        self.file = gzip.open(path, 'wt', encoding='utf-8')
+        self.parts_written = 0
+        self._last_key = None
+
+    def _write(self, record: dict) -> None:
+        self.file.write(json_dumps(record) + "\n")
+        self.file.flush()
+
+    def write_init(self, init: dict) -> None:
+        self._write(dict(init, type="init", keyframe_interval=self.keyframe_interval))
+
+    def write_part(self, part_state: 'PartState') -> None:
+        # A part that doesn't follow the last one written (or has no previous part) needs a keyframe
+        if self.parts_written % self.keyframe_interval == 0 or part_state.previous_key != self._last_key:
+            record = dict(type="keyframe", turn=part_state.turn, part=part_state.part, state=part_state.state)
+        else:
+            delta = part_state.delta_message['state']
+            record = dict(
+                type="delta",
+                turn=part_state.turn,
+                part=part_state.part,
+                units=delta['spawned'] + delta['changed'],
+                removed=delta['removed'],
+                players=delta['players'],
+            )
+            if 'groups' in delta:
+                record['groups'] = delta['groups']
+
+        self._write(record)
+        self._last_key = part_state.key
+        self.parts_written += 1
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class ReplayReader(object):
+    """Reads a replay written by `ReplayWriter` and rebuilds the full state of any part"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with gzip.open(path, 'rt', encoding='utf-8') as file:
+            self.init = json.loads(file.readline())
+        self.keyframe_interval = self.init['keyframe_interval']
+
+    def __iter__(self) -> Iterator[Tuple[int, str, dict]]:
+        """Yield (turn, part, state) for every part in order"""
+        return self._read()
+
+    def _read(self, start: int = 0):
+        units = {}
+        groups = []
+        with gzip.open(self.path, 'rt', encoding='utf-8') as file:
+            file.readline()
+            for index, line in enumerate(self._lines(file)):
+                # Nothing before the keyframe of the requested part needs to be decoded
+                if index < start - start % self.keyframe_interval:
+                    continue
+
+                record = json.loads(line)
+                if record['type'] == "keyframe":
+                    state = record['state']
+                    units = {unit['id']: unit for unit in state['units']}
+                    groups = state['groups']
+                    players = state['players']
+                else:
+                    for uid in record['removed']:
+                        del units[uid]
+                    for unit in record['units']:
+                        units[unit['id']] = unit
+                    groups = record.get('groups', groups)
+                    players = record['players']
+
+                if index >= start:
+                    yield record['turn'], record['part'], dict(units=list(units.values()), groups=groups, players=players)
+
+    @staticmethod
+    def _lines(file):
+        # A replay from a match that crashed has no gzip trailer, but every flushed part is still readable
+        try:
+            yield from file
+        except EOFError:
+            return
+
+    def __getitem__(self, index: int) -> dict:
+        """Rebuild the full state at the start of the given part (counting from the first part of the match)"""
+        for turn, part, state in self._read(index):
+            return state
+        raise IndexError(f"Replay has no part {index}")
@@ -1,6 +1,8 @@
 import copy
 from collections import deque, Counter, defaultdict
 import numpy as np
+from library.protocol import PARTS
+from .combat import resolve_attacks
 from .player import Player
 
 RESOURCE_TYPES = [None, None, None, "wood", "metal"]
@@ -39,46 +41,77 @@ class GameRound(object):
         attack, move, collect, spawn
         '''
 
-        self.game.output['turns'].append({})
+        with self.game.metrics.timer('round_seconds', record=False):
+            self.start_round(round_number)
+            for etype in PARTS:
+                self.start_part(round_number, etype)
+                self.finish_part(round_number, etype)
+            self.end_round(round_number)
 
+    def start_round(self, round_number):
+        ''' Pay out every player's income and reset the per round unit flags
+        '''
         for player in self.players:
             for item in player.balance:
                 player.balance[item] = player.balance[item] + 1
 
-        for unit in self.game.units:
-            unit.attacked_this_round = False
-            unit.moved_this_round = False
-            unit.collected_this_round = False
-
-        for etype in ["attack", "move", "collect", "spawn"]:
-            print("STARTING PART", round_number, etype, len(self.game.units))
-            self.game.output['turns'][-1][etype] = copy.deepcopy(self.game.get_state())
-
-            for player in self.players:
-                player.send_part_start(round_number, etype)
+        self.game.store.reset_flags()
 
-            Player.get_player_actions(self.players, etype, self.game.turn)
+    def start_part(self, round_number, etype):
+        ''' Record the state at the start of a part and send it to every player.
+        In-process bots play their part right away, bots in other processes are waited on in `finish_part`.
+        '''
+        print("STARTING PART", round_number, etype, len(self.game.units))
+        metrics = self.game.metrics
+        metrics.start_part(round_number, etype)
+        with metrics.timer('build_state_seconds', part=etype):
+            part_state = self.game.get_part_state(round_number, etype)
+        if self.game.replay:
+            self.game.replay.write_part(part_state)
+
+        self.game.barrier.open(round_number, etype, self.players)
+        for player in self.players:
+            player.send_part_start(round_number, etype, part_state)
+        # Players add up the time spent encoding their messages, the first of each protocol does the work
+        metrics.observe('encode_seconds', metrics.current('encode_seconds', 0.0), part=etype)
 
+    def finish_part(self, round_number, etype):
+        ''' Wait for every player to end the part, then carry out their commands
+        '''
+        metrics = self.game.metrics
+        durations = Player.get_player_actions(self.players, etype, self.game.turn)
+        for player_id, duration in durations.items():
+            if duration is None:
+                metrics.count('timeouts_total', part=etype, player=player_id)
+            else:
+                metrics.observe('response_seconds', duration, part=etype, player=player_id)
+        metrics.record('response_seconds', durations)
+
+        commands = {player.player_id: len(player.action_buffer[self.game.turn][etype]) for player in self.players}
+        for player_id, count in commands.items():
+            metrics.count('commands_total', count, part=etype, player=player_id)
+        metrics.record('commands', commands)
+
+        with metrics.timer('dispatch_seconds', part=etype):
             self.dispatch_actions(etype)
 
             if etype == "attack":
-                dead = []
-                for unit in self.game.units:
-                    if unit.health <= 0:
-                        dead.append(unit)
-
-                for unit in dead:
-                    print("Killing unit", unit.owner.player_id, unit.type, unit.id)
-                    self.game.remove_unit(unit)
-
-            # if etype == "move":
-            #     for unit in self.game.units:
-            #         if unit.queued_moves and not unit.moved_this_round:
-            #             unit.proceed()
-            #
-            #     for group in self.game.groups:
-            #         if group.queued_moves and not group.moved_this_round:
-            #             group.proceed()
+                self.game.remove_dead()
+
+        # if etype == "move":
+        #     for unit in self.game.units:
+        #         if unit.queued_moves and not unit.moved_this_round:
+        #             unit.proceed()
+        #
+        #     for group in self.game.groups:
+        #         if group.queued_moves and not group.moved_this_round:
+        #             group.proceed()
+
+    def end_round(self, round_number):
+        ''' Free this round's buffered actions, anything left over was never dispatched
+        '''
+        for player in self.players:
+            player.action_buffer.pop(round_number, None)
 
     def dispatch_attack(self, actor, target):
         if actor.owner is target.owner:
@@ -87,7 +120,7 @@ class GameRound(object):
         if actor.attacked_this_round:
             raise RuntimeError(f"{actor} has already attacked this round!")
 
-        if np.linalg.norm(np.array(actor.position) - np.array(target.position)) > actor.attack_range:
+        if not self.game.spatial.within(actor._row, target._row, actor.attack_range):
             raise RuntimeError(f"{actor} attempted to hit out of his range!")
         target.health -= actor.attack
         actor.attacked_this_round = True
@@ -137,7 +170,24 @@ class GameRound(object):
         # {x: player.balance[x] - y for x, y in self.game.costs[unit_type].items()}
         self.game.create_unit(player, unit_type)
 
+    def dispatch_attacks(self):
+        """Resolve every player's attack commands for this part in one batch"""
+        owners, attackers, targets = [], [], []
+        for player in self.players:
+            buffer = player.action_buffer[self.game.turn]['attack']
+            while buffer:
+                action = buffer.popleft()
+                if action['command'] == 'attack':
+                    owners.append(player.player_id)
+                    attackers.append(action['unit'])
+                    targets.append(action['target'])
+
+        resolve_attacks(self.game, owners, attackers, targets)
+
     def dispatch_actions(self, etype):
+        if etype == 'attack':
+            return self.dispatch_attacks()
+
         for player in self.players:
             collections = defaultdict(lambda: False)
             while player.action_buffer[self.game.turn][etype]:
@@ -0,0 +1,219 @@
+import asyncio
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import traceback
+
+from library.protocol import FRAME, MAP_ENCODINGS, PROTOCOLS, decode_command
+
+HELLO_TIMEOUT = 0.5  # seconds a new connection gets to identify itself before it is assigned a free slot
+ACCEPT_TIMEOUT = 15  # seconds to wait for every bot to connect
+TRANSPORTS = ("tcp", "unix", "socketpair")
+
+
+class GameServer(object):
+    """
+    Transport layer between the engine and the bots.
+
+    A single asyncio event loop, running on one background thread, accepts every bot
+    connection at the same time and reads and frames their commands. Parsed commands are
+    handed to the owning `Player`, which buffers them for `GameRound`. The engine itself stays
+    synchronous and talks to the loop through the thread-safe methods on this class.
+
+    Bots identify themselves with a `hello` command carrying their player id (library bots do
+    this automatically). Connections that don't say hello within HELLO_TIMEOUT are assigned
+    the lowest free player slot, so bots written against the old protocol still work.
+
+    Bots are told where to connect by the address passed as their first argument, which depends
+    on the transport:
+    - tcp: the port number on localhost
+    - unix: `unix:<path>` of a Unix domain socket
+    - socketpair: `fd:<n>`, one end of a socket pair the bot inherits. It is connected from the
+      start, so nothing has to be accepted and the player's slot is always known.
+
+    The hello also negotiates the wire protocol (see `library.protocol`). Bots which don't ask for
+    the binary protocol use newline separated JSON. Bots which set `delta` in it are sent only
+    the changes since the previous part in part_start, after a first full snapshot. Bots which
+    set `map_encoding` get the map of the initialize message in that compact encoding.
+    """
+
+    def __init__(self, player_ids, host='localhost', port=6667, transport="tcp", unit_types=()):
+        if transport not in TRANSPORTS:
+            raise RuntimeError(f"Invalid transport {transport}, expected one of {TRANSPORTS}")
+        self.player_ids = list(player_ids)  # The player slots which connect through this server
+        self.host = host
+        self.port = port
+        self.transport = transport
+        self.unit_types = list(unit_types)  # The unit type enum of the binary protocol
+        self.protocols = {}  # The protocol each player asked for in their hello
+        self.deltas = set()  # The players who asked for delta part_start messages
+        self.map_encodings = {}  # The map encoding each player asked for in their hello
+        self.socket_dir = None
+        self.child_sockets = {}
+        self.players = None
+        self._pending = []  # Commands that arrived before the players were registered, as (player id, message)
+        self.server = None
+        self.writers = {}
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._connected = threading.Event()
+
+    def _run(self, coro, timeout=None):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def start(self) -> None:
+        """Start the event loop and begin listening for bots"""
+        self.thread.start()
+        if self.transport == "tcp":
+            self.server = self._run(asyncio.start_server(self._on_connect, self.host, self.port))
+            self.port = self.server.sockets[0].getsockname()[1]
+        elif self.transport == "unix":
+            self.socket_dir = tempfile.mkdtemp(prefix="aigame-")
+            self.server = self._run(asyncio.start_unix_server(self._on_connect, self.socket_path))
+        else:
+            for player_id in self.player_ids:
+                parent, child = socket.socketpair()
+                self.child_sockets[player_id] = child
+                self._run(self._attach(player_id, parent))
+
+    @property
+    def socket_path(self):
+        return os.path.join(self.socket_dir, "game.sock")
+
+    def address(self, player_id: int) -> str:
+        """Where the given player's bot should connect, passed to it as its first argument"""
+        if self.transport == "tcp":
+            return str(self.port)
+        elif self.transport == "unix":
+            return f"unix:{self.socket_path}"
+        return f"fd:{self.child_sockets[player_id].fileno()}"
+
+    def inherited_fds(self, player_id: int) -> tuple:
+        """File descriptors the given player's bot process has to inherit"""
+        if self.transport == "socketpair":
+            return self.child_sockets[player_id].fileno(),
+        return ()
+
+    def launched(self, player_id: int) -> None:
+        """Called once the player's bot process has started, drops the engine's copy of its socket"""
+        child = self.child_sockets.pop(player_id, None)
+        if child is not None:
+            child.close()
+
+    async def _attach(self, player_id, sock):
+        reader, writer = await asyncio.open_connection(sock=sock)
+        asyncio.ensure_future(self._serve(reader, writer, player_id))
+
+    def wait_for_players(self, players, timeout=ACCEPT_TIMEOUT) -> None:
+        """Block until every player's bot has connected"""
+        self._run(self._set_players({player.player_id: player for player in players}))
+        if not self._connected.wait(timeout):
+            missing = [pid for pid in self.player_ids if pid not in self.writers]
+            raise RuntimeError(f"Players {missing} did not connect within {timeout} seconds")
+
+    async def _set_players(self, players):
+        # Runs on the event loop, so no command is dispatched while the held back ones are passed on
+        self.players = players
+        pending, self._pending = self._pending, []
+        for player_id, message in pending:
+            self._dispatch(player_id, message)
+
+    async def _on_connect(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        await self._serve(reader, writer)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, player_id=None):
+        first = None
+        try:
+            first = await asyncio.wait_for(reader.readline(), HELLO_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+
+        try:
+            message = json.loads(first) if first and first.strip() else None
+        except ValueError:
+            print(f"Invalid first line {first!r}, treating the connection as having no hello")
+            message = None
+        if not isinstance(message, dict):
+            message = None
+        if message is not None and message.get('command') == 'hello':
+            if player_id is None:
+                player_id = int(message['player_id'])
+            protocol = message.get('protocol', "json")
+            self.protocols[player_id] = protocol if protocol in PROTOCOLS else "json"
+            if message.get('delta'):
+                self.deltas.add(player_id)
+            if message.get('map_encoding') in MAP_ENCODINGS:
+                self.map_encodings[player_id] = message['map_encoding']
+            message = None
+        elif player_id is None:
+            player_id = next((i for i in self.player_ids if i not in self.writers), None)
+
+        if player_id is None or player_id in self.writers or player_id not in self.player_ids:
+            print(f"Rejecting connection for player slot {player_id}")
+            writer.close()
+            return
+
+        self._register(player_id, writer)
+        if message is not None:
+            self._dispatch(player_id, message)
+        await self._read_commands(player_id, reader)
+
+    def _register(self, player_id, writer):
+        self.writers[player_id] = writer
+        if len(self.writers) == len(self.player_ids):
+            self._connected.set()
+
+    async def _read_commands(self, player_id, reader: asyncio.StreamReader):
+        binary = self.protocols.get(player_id) == "binary"
+        try:
+            while True:
+                if binary:
+                    try:
+                        length, = FRAME.unpack(await reader.readexactly(FRAME.size))
+                        body = await reader.readexactly(length)
+                    except asyncio.IncompleteReadError:
+                        return
+                    self._dispatch(player_id, decode_command(body, self.unit_types))
+                    continue
+
+                data = await reader.readline()
+                if not data:
+                    return
+                if data.strip():
+                    self._dispatch(player_id, json.loads(data))
+        except Exception:
+            traceback.print_exc()
+            print(f"Invalid input from player {player_id}, no longer reading their commands")
+
+    def _dispatch(self, player_id, message):
+        if self.players is None:
+            self._pending.append((player_id, message))
+            return
+        self.players[player_id].handle_message(message)
+
+    def send(self, player_id: int, data: bytes) -> None:
+        """Queue data to be written to a player's connection. Safe to call from any thread."""
+        self.loop.call_soon_threadsafe(self.writers[player_id].write, data)
+
+    def close(self) -> None:
+        """Flush every connection, then stop the server and the event loop"""
+        if self.thread.is_alive():
+            self._run(self._close())
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+
+    async def _close(self):
+        for writer in self.writers.values():
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+            writer.close()
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.socket_dir:
+            shutil.rmtree(self.socket_dir, ignore_errors=True)
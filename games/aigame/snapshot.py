@@ -0,0 +1,30 @@
+class GameSnapshot(object):
+    """
+    Everything needed to put an AIGame back to an earlier point, taken by `AIGame.snapshot`.
+
+    Units are kept as copies of the unit store's columns rather than as objects, so taking
+    and restoring a snapshot costs a handful of array copies. The spatial grid isn't kept,
+    it is rebuilt from the restored positions. A snapshot taken while a part is
+    under way also holds the commands and part endings received so far, so the part can be
+    finished from it again.
+    """
+    __slots__ = ('store', 'groups', 'balances', 'actions', 'barrier', 'unit_counter', 'group_counter',
+                 'turn', 'part_state', 'random_state')
+
+    def __init__(self, store, groups, balances, actions, barrier, unit_counter, group_counter, turn,
+                 part_state, random_state):
+        self.store = store  # UnitStore.snapshot()
+        self.groups = groups  # (id, owner id, position, member ids) of every group
+        self.balances = balances  # Every player's balance, in player order
+        self.actions = actions  # Every player's buffered commands as {turn: {part: [command]}}, in player order
+        self.barrier = barrier  # PartBarrier.snapshot()
+        self.unit_counter = unit_counter
+        self.group_counter = group_counter
+        self.turn = turn
+        self.part_state = part_state  # The state sent at the start of the last part
+        self.random_state = random_state  # The game's np_random state
+
+    @property
+    def part(self):
+        """The last part started before the snapshot was taken"""
+        return self.part_state.part if self.part_state is not None else None
@@ -0,0 +1,139 @@
+from collections import defaultdict
+from typing import Tuple
+
+import numpy as np
+
+CELL_SIZE = 16  # tiles per side of a grid cell
+
+
+class SpatialGrid(object):
+    """
+    Uniform grid over the map for range queries on units.
+
+    Each cell covers CELL_SIZE x CELL_SIZE tiles and holds the UnitStore rows of the units
+    standing in it. The grid is updated incrementally as units are created, moved and removed,
+    so a radius query only has to look at the cells the circle touches.
+    All queries take and return store rows, use `store.id[rows]` to get unit ids.
+    """
+
+    def __init__(self, store: 'UnitStore', cell_size: int = CELL_SIZE):
+        self.store = store
+        self.cell_size = cell_size
+        self.cells = defaultdict(set)
+        self.cell_of = {}
+
+    def _cell(self, position) -> Tuple[int, int]:
+        return int(position[0]) // self.cell_size, int(position[1]) // self.cell_size
+
+    def insert(self, row: int, position) -> None:
+        cell = self._cell(position)
+        self.cells[cell].add(row)
+        self.cell_of[row] = cell
+
+    def move(self, row: int, position) -> None:
+        cell = self._cell(position)
+        old = self.cell_of.get(row)
+        if old == cell:
+            return
+        if old is not None:
+            self._discard(row, old)
+        self.cells[cell].add(row)
+        self.cell_of[row] = cell
+
+    def remove(self, row: int) -> None:
+        self._discard(row, self.cell_of.pop(row))
+
+    def _discard(self, row, cell):
+        self.cells[cell].discard(row)
+        if not self.cells[cell]:
+            del self.cells[cell]
+
+    def rebuild(self) -> None:
+        """Put every live unit of the store back in its cell, after the store was restored from a snapshot"""
+        rows = np.flatnonzero(self.store.alive[:self.store.size])
+        cells = self.store.position[rows] // self.cell_size
+        self.cell_of = dict(zip(rows.tolist(), zip(cells[:, 0].tolist(), cells[:, 1].tolist())))
+        self.cells = defaultdict(set)
+        if not len(rows):
+            return
+        order = np.lexsort((cells[:, 1], cells[:, 0]))
+        cells = cells[order]
+        starts = np.flatnonzero((cells[1:] != cells[:-1]).any(axis=1)) + 1
+        for cell, members in zip(cells[np.r_[0, starts]].tolist(), np.split(rows[order], starts)):
+            self.cells[tuple(cell)] = set(members.tolist())
+
+    def _rows_in(self, cells) -> np.ndarray:
+        rows = [row for cell in cells if cell in self.cells for row in self.cells[cell]]
+        return np.array(rows, dtype=np.int64)
+
+    def _distances(self, position, rows: np.ndarray) -> np.ndarray:
+        return np.hypot(*(self.store.position[rows] - np.asarray(position)).T)
+
+    def query_radius(self, position, radius: float) -> np.ndarray:
+        """Rows of every unit within radius of the position"""
+        reach = int(np.ceil(radius / self.cell_size))
+        cx, cy = self._cell(position)
+        cells = [(x, y) for x in range(cx - reach, cx + reach + 1) for y in range(cy - reach, cy + reach + 1)]
+        rows = self._rows_in(cells)
+        return rows[self._distances(position, rows) <= radius]
+
+    def k_nearest(self, position, k: int) -> np.ndarray:
+        """Rows of the k units nearest to the position, nearest first"""
+        if not self.cell_of:
+            return np.empty(0, dtype=np.int64)
+        cx, cy = self._cell(position)
+        cells = np.array(list(self.cells))
+        max_ring = int(np.abs(cells - (cx, cy)).max())
+
+        rows = np.empty(0, dtype=np.int64)
+        for ring in range(max_ring + 1):
+            ring_cells = [(x, y) for x in range(cx - ring, cx + ring + 1) for y in range(cy - ring, cy + ring + 1)
+                          if max(abs(x - cx), abs(y - cy)) == ring]
+            rows = np.concatenate([rows, self._rows_in(ring_cells)])
+            # Every unit outside the rings searched so far is at least ring * cell_size away
+            if len(rows) >= k and np.sort(self._distances(position, rows))[k - 1] <= ring * self.cell_size:
+                break
+
+        return rows[np.argsort(self._distances(position, rows), kind='stable')[:k]]
+
+    def within(self, row_a: int, row_b: int, radius: float) -> bool:
+        """Whether two units are within radius of each other"""
+        (ax, ay), (bx, by) = self.cell_of[row_a], self.cell_of[row_b]
+        if (max(abs(ax - bx), abs(ay - by)) - 1) * self.cell_size > radius:
+            return False
+        return np.hypot(*(self.store.position[row_a] - self.store.position[row_b])) <= radius
+
+    def pairs_within(self, radius: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Every pair of units within radius of each other, each pair reported once.
+
+        :return: Two arrays of rows, (first[i], second[i]) is a pair
+        """
+        reach = int(np.ceil(radius / self.cell_size))
+        # Only look at neighbours "after" each cell so no pair is checked twice
+        offsets = [(x, y) for x in range(0, reach + 1) for y in range(-reach, reach + 1) if x > 0 or y >= 0]
+
+        firsts, seconds = [], []
+        for (cx, cy), members in self.cells.items():
+            rows = np.fromiter(members, dtype=np.int64, count=len(members))
+            positions = self.store.position[rows]
+            for ox, oy in offsets:
+                if (ox, oy) == (0, 0):
+                    others, other_positions = rows, positions
+                elif (cx + ox, cy + oy) in self.cells:
+                    others = self._rows_in([(cx + ox, cy + oy)])
+                    other_positions = self.store.position[others]
+                else:
+                    continue
+
+                diff = positions[:, None, :] - other_positions[None, :, :]
+                close = np.hypot(diff[..., 0], diff[..., 1]) <= radius
+                if (ox, oy) == (0, 0):
+                    close = np.triu(close, 1)
+                first, second = np.nonzero(close)
+                firsts.append(rows[first])
+                seconds.append(others[second])
+
+        if not firsts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return np.concatenate(firsts), np.concatenate(seconds)
@@ -0,0 +1,154 @@
+from typing import Iterable, List
+
+import numpy as np
+
+from library.protocol import NO_VIEW_RANGE, UNIT_DTYPE, unit_dicts
+
+STAT_COLUMNS = ('speed', 'health', 'attack', 'defense', 'attack_range', 'view_range', 'collect_amount')
+FLAG_COLUMNS = ('attacked_this_round', 'moved_this_round', 'collected_this_round')
+
+
+class UnitStore(object):
+    """
+    Columnar storage for every unit in the game.
+
+    Each unit is one row across a set of NumPy arrays, so per-round work (flag resets,
+    the dead unit sweep, serialization) runs as array operations instead of Python loops.
+    Rows of removed units go on a free list and are reused by new units, and `index` maps
+    unit ids to their row. `units.Unit` objects are thin views over a row.
+    """
+
+    def __init__(self, type_names: Iterable[str], capacity: int = 64):
+        self.type_names = list(type_names)
+        self.type_codes = {name: code for code, name in enumerate(self.type_names)}
+        self.index = {}
+        self.free = []
+        self.size = 0  # Rows below this have been used at some point
+        self.capacity = 0
+
+        self.id = np.empty(0, dtype=np.int64)
+        self.owner = np.empty(0, dtype=np.int16)
+        self.type = np.empty(0, dtype=np.int8)
+        self.position = np.empty((0, 2), dtype=np.int64)
+        self.alive = np.empty(0, dtype=bool)
+        for name in STAT_COLUMNS:
+            setattr(self, name, np.empty(0, dtype=np.int64))
+        for name in FLAG_COLUMNS:
+            setattr(self, name, np.empty(0, dtype=bool))
+
+        self._grow(capacity)
+
+    @property
+    def columns(self) -> List[str]:
+        return ['id', 'owner', 'type', 'position', 'alive', *STAT_COLUMNS, *FLAG_COLUMNS]
+
+    def _grow(self, capacity: int) -> None:
+        for name in self.columns:
+            old = getattr(self, name)
+            new = np.zeros((capacity, *old.shape[1:]), dtype=old.dtype)
+            new[:self.capacity] = old
+            setattr(self, name, new)
+        self.capacity = capacity
+
+    def __len__(self):
+        return len(self.index)
+
+    def add(self, uid: int, owner: int, type_name: str, position, stats: dict) -> int:
+        """Add a unit and return its row"""
+        if self.free:
+            row = self.free.pop()
+        else:
+            if self.size == self.capacity:
+                self._grow(self.capacity * 2)
+            row = self.size
+            self.size += 1
+
+        self.id[row] = uid
+        self.owner[row] = owner
+        self.type[row] = self.type_codes[type_name]
+        self.position[row] = position
+        self.alive[row] = True
+        for name in STAT_COLUMNS:
+            value = stats[name]
+            getattr(self, name)[row] = NO_VIEW_RANGE if value is None else value
+        for name in FLAG_COLUMNS:
+            getattr(self, name)[row] = False
+
+        self.index[uid] = row
+        return row
+
+    def snapshot(self) -> dict:
+        """Copy every column up to the highest row used so far, along with the free rows"""
+        return dict(
+            size=self.size,
+            free=list(self.free),
+            columns={name: getattr(self, name)[:self.size].copy() for name in self.columns},
+        )
+
+    def restore(self, snapshot: dict) -> None:
+        """Put the store back to a snapshot, reusing the current arrays where they are large enough"""
+        size = snapshot['size']
+        if size > self.capacity:
+            self._grow(max(size, self.capacity * 2))
+        for name, column in snapshot['columns'].items():
+            getattr(self, name)[:size] = column
+        self.alive[size:] = False  # Rows first used after the snapshot was taken
+        self.size = size
+        self.free = list(snapshot['free'])
+        rows = np.flatnonzero(self.alive[:size])
+        self.index = dict(zip(self.id[rows].tolist(), rows.tolist()))
+
+    def remove(self, uids: Iterable[int]) -> None:
+        """Remove units by id and free their rows"""
+        rows = [self.index.pop(uid) for uid in uids]
+        self.alive[rows] = False
+        self.free.extend(rows)
+
+    def rows(self) -> np.ndarray:
+        """The rows of every live unit, in id order"""
+        rows = np.flatnonzero(self.alive[:self.size])
+        return rows[np.argsort(self.id[rows], kind='stable')]
+
+    def ids(self, mask: np.ndarray = None) -> np.ndarray:
+        """Ids of live units, optionally only those whose row is set in the given mask"""
+        rows = self.rows()
+        if mask is not None:
+            rows = rows[mask[rows]]
+        return self.id[rows]
+
+    def rows_of(self, ids) -> np.ndarray:
+        """Rows of the units with the given ids, -1 for ids which aren't live units"""
+        ids = np.asarray(ids, dtype=np.int64)
+        live = np.flatnonzero(self.alive[:self.size])
+        lookup = np.full(max(self.id[live].max(initial=-1), ids.max(initial=-1)) + 1, -1, dtype=np.int64)
+        lookup[self.id[live]] = live
+        rows = np.full(len(ids), -1, dtype=np.int64)
+        known = ids >= 0
+        rows[known] = lookup[ids[known]]
+        return rows
+
+    def owned_by(self, player_id: int) -> np.ndarray:
+        """Ids of every live unit belonging to a player"""
+        return self.ids(self.owner == player_id)
+
+    def dead(self) -> np.ndarray:
+        """Ids of live units which have run out of health"""
+        return self.ids(self.health <= 0)
+
+    def reset_flags(self) -> None:
+        """Clear the once-per-round action flags of every unit"""
+        for name in FLAG_COLUMNS:
+            getattr(self, name)[:] = False
+
+    def records(self, rows: np.ndarray = None) -> np.ndarray:
+        """Every live unit as packed UNIT_DTYPE records, in id order, or the units of the given rows"""
+        if rows is None:
+            rows = self.rows()
+        records = np.empty(len(rows), dtype=UNIT_DTYPE)
+        for name in ('id', 'owner', 'type', 'position', *STAT_COLUMNS):
+            records[name] = getattr(self, name)[rows]
+        return records
+
+    def serialize(self) -> List[dict]:
+        """Return a JSON representable list of every live unit, built column by column"""
+        return unit_dicts(self.records(), self.type_names)
@@ -0,0 +1,128 @@
+import contextlib
+import itertools
+import os
+import signal
+import time
+import traceback
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List
+
+MATCH_TIMEOUT = 600  # seconds
+
+
+class MatchTimeout(Exception):
+    pass
+
+
+def _on_timeout(signum, frame):
+    raise MatchTimeout()
+
+
+def schedule(paths: List[str], games: int = 1, players: int = 2) -> List[dict]:
+    """
+    Round robin schedule: every combination of bots plays `games` matches, rotating seats
+    between matches so each bot gets every starting corner.
+    """
+    matches = []
+    for combination in itertools.combinations(paths, players):
+        for game in range(games):
+            shift = game % players
+            seats = list(combination[shift:] + combination[:shift])
+            matches.append(dict(id=len(matches), paths=seats))
+    return matches
+
+
+def play_match(match: dict) -> dict:
+    """
+    Play one match in this process and return its results. Runs in a worker of the pool.
+
+    Each match listens on its own free port, so any number can run on one host. A match that
+    runs past its timeout is stopped, its bots are killed, and it is reported as timed out.
+    """
+    from .game import AIGame
+
+    log_dir = match.get('log_dir')
+    log_path = os.path.join(log_dir, f"match-{match['id']}.log") if log_dir else os.devnull
+    replay_dir = match.get('replay_dir') or "."
+
+    start = time.monotonic()
+    result = dict(id=match['id'], paths=match['paths'], status="finished")
+    signal.signal(signal.SIGALRM, _on_timeout)
+    signal.alarm(match.get('timeout', MATCH_TIMEOUT))
+    game = None
+    try:
+        with open(log_path, 'w') as log, contextlib.redirect_stdout(log):
+            game = AIGame(
+                match['paths'],
+                replay_path=os.path.join(replay_dir, f"match-{match['id']}.jsonl.gz"),
+                metrics_path=os.path.join(replay_dir, f"match-{match['id']}.metrics"),
+                map_seed=match.get('map_seed'),
+                port=0,
+                transport=match.get('transport', "tcp"),
+            )
+            result.update(game.run())
+    except MatchTimeout:
+        result['status'] = "timeout"
+    except Exception:
+        result['status'] = "error"
+        result['error'] = traceback.format_exc()
+    finally:
+        signal.alarm(0)
+        if game is not None:
+            game.close()
+            if result['status'] != "finished":
+                result.update(game.results())
+
+    result['duration'] = time.monotonic() - start
+    return result
+
+
+def summarize(results: List[dict]) -> dict:
+    """Aggregate wins, balances and durations per bot"""
+    bots = defaultdict(lambda: dict(matches=0, wins=0, total_balance=0))
+    for result in results:
+        for player_id, path in enumerate(result['paths']):
+            bot = bots[path]
+            bot['matches'] += 1
+            if result['status'] == "finished" and result.get('winner') == player_id:
+                bot['wins'] += 1
+            balances = result.get('balances') or {}
+            bot['total_balance'] += sum(balances.get(player_id, {}).values())
+
+    for bot in bots.values():
+        bot['win_rate'] = bot['wins'] / bot['matches']
+        bot['mean_balance'] = bot['total_balance'] / bot['matches']
+
+    durations = [result['duration'] for result in results]
+    return dict(
+        matches=len(results),
+        statuses=dict(Counter(result['status'] for result in results)),
+        mean_duration=sum(durations) / len(durations) if durations else 0,
+        max_duration=max(durations, default=0),
+        bots=dict(bots),
+    )
+
+
+def run_tournament(matches: List[dict], workers: int = None, timeout: int = MATCH_TIMEOUT,
+                   replay_dir: str = None, log_dir: str = None, transport: str = "tcp") -> dict:
+    """Play every match across a pool of worker processes and return every result plus a summary"""
+    for directory in (replay_dir, log_dir):
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+    for match in matches:
+        match.setdefault('timeout', timeout)
+        match.setdefault('replay_dir', replay_dir)
+        match.setdefault('log_dir', log_dir)
+        match.setdefault('transport', transport)
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = [pool.submit(play_match, match) for match in matches]
+        for future in as_completed(futures):
+            result = future.result()
+            print(f"Match {result['id']} {result['status']} in {result['duration']:.1f}s: winner {result.get('winner_path')}")
+            results.append(result)
+
+    results.sort(key=lambda result: result['id'])
+    return dict(results=results, summary=summarize(results))
@@ -28,4 +28,10 @@ unit_stats = {
         view_range=None,
         collect_amount=0,
     )
-}
\ No newline at end of file
+}
+
+# View ranges under fog of war, units see everything without it
+fog_view_ranges = {
+    "gatherer": 20,
+    "attacker": 30,
+}
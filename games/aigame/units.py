@@ -5,29 +5,71 @@ from typing import List, Callable, Optional, Union
 import numpy as np
 
 from . import game, player
-from .utils import raycast
+from library.protocol import NO_VIEW_RANGE
 
 
-@dataclass(init=True, repr=True, eq=True)
-class Unit:  # use dataclass?
-    """A base class for all units on the field"""
-    game: 'game.Game'
-    id: int
-    owner: 'player.Player'  # owner_id
-    type: str
-    speed: int
-    health: int
-    attack: int
-    defense: int
-    view_range: int
-    attack_range: int
-    collect_amount: int
-    position: np.ndarray  # size 2, alternatively 2-tuple
-    attacked_this_round = False
-    moved_this_round = False
-    collected_this_round = False
-
-    _group: 'Group' = field(default=None)  # This should only be modified from the relevant group object
+
+def _column(name):
+    """A unit attribute stored in a column of the game's UnitStore"""
+    def fget(self):
+        return getattr(self.game.store, name)[self._row].item()
+
+    def fset(self, value):
+        getattr(self.game.store, name)[self._row] = value
+
+    return property(fget, fset)
+
+
+class Unit:
+    """A base class for all units on the field.
+    The unit's data lives in a row of the game's UnitStore, this object is only a view of that row."""
+
+    def __init__(self, game: 'game.Game', id: int):
+        self.game = game
+        self.id = id
+        self._row = game.store.index[id]
+        self._group = None  # This should only be modified from the relevant group object
+
+    speed = _column('speed')
+    health = _column('health')
+    attack = _column('attack')
+    defense = _column('defense')
+    attack_range = _column('attack_range')
+    collect_amount = _column('collect_amount')
+    attacked_this_round = _column('attacked_this_round')
+    moved_this_round = _column('moved_this_round')
+    collected_this_round = _column('collected_this_round')
+
+    @property
+    def owner(self) -> 'player.Player':
+        return self.game.players[self.game.store.owner[self._row]]
+
+    @property
+    def type(self) -> str:
+        return self.game.store.type_names[self.game.store.type[self._row]]
+
+    @property
+    def view_range(self) -> Optional[int]:
+        view_range = self.game.store.view_range[self._row].item()
+        return None if view_range == NO_VIEW_RANGE else view_range
+
+    @property
+    def position(self) -> np.ndarray:
+        return self.game.store.position[self._row].copy()
+
+    @position.setter
+    def position(self, value):
+        self.game.store.position[self._row] = value
+        self.game.spatial.move(self._row, value)
+
+    def __hash__(self):
+        return self.id
+
+    def __eq__(self, other):
+        return self.id == other.id and self.__class__ == other.__class__
+
+    def __repr__(self):
+        return f"Unit(id={self.id}, owner={self.owner.player_id}, type={self.type}, health={self.health}, position={self.position})"
 
     def move(self, npos) -> None:  # , new=True
         """Move the unit to a new location. If its further than can be moved this turn, move as far as possible and queue the rest of the movement to happen later."""
@@ -44,11 +86,11 @@ class Unit:  # use dataclass?
             diff = self.speed / dist * diff
             # self.queued_moves.append(npos)
 
-        for step in raycast(self.position, self.position + diff):
-            if self.game.map[tuple(step)] == 1:
-                raise RuntimeError(f"{self} attempted invalid move to or through impassable tile {self}")
+        end = (self.position + diff).astype(int)
+        if not self.game.passability.is_clear(self.position, end):
+            raise RuntimeError(f"{self} attempted invalid move to or through impassable tile {self}")
 
-        self.position = (self.position + diff).astype(int)
+        self.position = end
 
     # NOTE: Code moved to client side
     # queued_moves: List[np.ndarray] = field(default_factory=deque)
@@ -61,10 +103,16 @@ class Unit:  # use dataclass?
     def units_within(self, dist: float, check: Optional[Callable[['Unit'], bool]] = None) -> List['Unit']:
         """Get a list of all units within the given distance of the unit.
         Optionally pass a check function and only return units which pass the check."""
-        for unit in self.game.units:
+        rows = self.game.spatial.query_radius(self.position, dist)
+        for uid in np.sort(self.game.store.id[rows]).tolist():
+            unit = self.game.get_unit(uid)
             if ((unit != self) and check(unit)) if check else True:
-                if np.hypot(*(np.array(unit.position) - np.array(self.position))) <= dist:
-                    yield unit
+                yield unit
+
+    def nearest_units(self, k: int) -> List['Unit']:
+        """Get the k units nearest to this unit, nearest first (not including itself)"""
+        rows = self.game.spatial.k_nearest(self.position, k + 1)
+        return [self.game.get_unit(uid) for uid in self.game.store.id[rows].tolist() if uid != self.id][:k]
 
     def groups_within(self, dist: float, check: Optional[Callable[['Group'], bool]] = None) -> List['Group']:
         """Get a list of all groups within the given distance of the unit.
@@ -87,7 +135,7 @@ class Unit:  # use dataclass?
             attack_range=self.attack_range,
             view_range=self.view_range,
             collect_amount=self.collect_amount,
-            position=list(self.position)
+            position=self.position.tolist()
         )
 
 
@@ -152,9 +200,8 @@ class Group:
         if dist > self.speed:
             diff = self.speed / dist * diff
 
-        for step in raycast(self.position, self.position + diff):
-            if self.game.map[tuple(step)] == 1:
-                raise RuntimeError(f"{self} attempted invalid move to or through impassable tile {self}")
+        if not self.game.passability.is_clear(self.position, (self.position + diff).astype(int)):
+            raise RuntimeError(f"{self} attempted invalid move to or through impassable tile {self}")
 
         for unit in self.members:
             unit.move((npos + diff).astype(int))
@@ -183,10 +230,11 @@ class Group:
     def units_within(self, dist: float, check: Optional[Callable[[Unit], bool]] = None) -> List[Unit]:
         """Get a list of all units within the given distance of the group.
         Optionally pass a check function and only return units which pass the check."""
-        for unit in self.game.units:
+        rows = self.game.spatial.query_radius(self.position, dist)
+        for uid in np.sort(self.game.store.id[rows]).tolist():
+            unit = self.game.get_unit(uid)
             if unit != self and check(unit) if check else True:
-                if np.hypot(*(np.array(unit.position) - np.array(self.position))) <= dist:
-                    yield unit
+                yield unit
 
     def groups_within(self, dist: float, check: Optional[Callable[['Group'], bool]] = None) -> List['Group']:
         """Get a list of all groups within the given distance of the group.
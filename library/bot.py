@@ -9,6 +9,13 @@ import socket
 import numpy as np
 
 from library import units
+from library.passability import PassabilityMap
+from library.pathfinding import Pathfinder
+from library.protocol import (END_GAME, PART_DELTA, PART_START, decode_map, decode_part_delta, decode_part_start,
+                              encode_command, split_frame, unit_dicts)
+from library.resources import ResourceIndex
+from library.simulator import Simulator
+from library.transport import connect
 from library.utils import json_dumps
 
 
@@ -18,22 +25,50 @@ class Bot:
     running = False
     turn = 0
     map = None
+    passability = None
+    resources = None  # Index of the resource nodes on the map, see library.resources
     player_id = None
     num_players = None
     balance = None
     costs = None
     part = None
-
-    def __init__(self, logging_events=('in', 'out', 'calls')):
+    protocol = "json"  # Wire protocol asked for in the hello, "binary" for packed frames (see library.protocol)
+    map_encoding = "raw"  # How the initial map is sent, see library.protocol.encode_map ("rle" is smaller, "raw" needs no copy)
+    delta = False  # Ask for only the changes since the previous part in part_start, after a first full snapshot
+    precompute_paths = True  # Build the flow fields to every resource node and home in the background once the map arrives
+    unit_types = None
+    unit_stats = None
+    home = None
+    homes = None
+    _simulator = None
+    _pathfinder = None
+    unit_array = None  # The units of the last part_start as packed records, when using the binary protocol
+    # Ids of the units which changed with the last part_start. Units which go out of view under fog of war count as died.
+    spawned = frozenset()
+    died = frozenset()
+    moved = frozenset()
+
+    def __init__(self, logging_events=('in', 'out', 'calls'), handler=None):
+        """
+        :param handler: Run the bot inside the game's process: commands are passed to this callable
+            instead of being sent over a socket, and the game calls the on_*_raw methods directly.
+        """
         self._units = {}
         self._groups = {}
+        self._positions = {}  # Position of each unit in the last state the game sent, to tell which units moved
         self.output = []
         self.player_balances = {}
-        self.sock = socket.socket()
-        self.sock.connect(('localhost', self.sock.connect(('localhost', int(sys.argv[1])))))
+        self._handler = handler
         self._buffer = b""
-
         self.logging_events = logging_events
+        if handler is not None:
+            return
+
+        self.sock = connect(sys.argv[1])
+        if len(sys.argv) > 2:
+            # Tell the engine which player slot this connection belongs to
+            self.send(dict(command='hello', player_id=int(sys.argv[2]), protocol=self.protocol, delta=self.delta,
+                           map_encoding=self.map_encoding))
 
     @property
     def myunits(self):
@@ -71,6 +106,18 @@ class Bot:
         """Send a payload to the game"""
         payload['turn'] = self.turn
         payload['part'] = self.part
+        if self._handler is not None:
+            self._handler(payload)
+            if 'out' in self.logging_events:
+                self.log(payload)
+            return
+
+        if self.protocol == "binary" and self.unit_types is not None:
+            self.sock.send(encode_command(payload, self.unit_types))
+            if 'out' in self.logging_events:
+                self.log(payload)
+            return
+
         if not isinstance(payload, str):
             payload = json_dumps(payload)
 
@@ -91,6 +138,32 @@ class Bot:
         msg, self._buffer = self._buffer.split(b"\r\n", 1)
         return msg
 
+    def recv_frame(self) -> bytes:
+        """Read one binary protocol frame body, None once the connection is closed"""
+        body, self._buffer = split_frame(self._buffer)
+        while body is None:
+            data = self.sock.recv(65536)
+            if not data:
+                return None
+            body, self._buffer = split_frame(self._buffer + data)
+        return body
+
+    def recv_event(self) -> dict:
+        """Read the next message from the game, in whichever protocol was agreed on"""
+        if self.protocol != "binary":
+            return json.loads(self.recv())
+
+        body = self.recv_frame()
+        if body is None:
+            raise RuntimeError("Connection to the game closed")
+        if body[0] == PART_START:
+            return decode_part_start(body)
+        elif body[0] == PART_DELTA:
+            return decode_part_delta(body)
+        elif body[0] == END_GAME:
+            return dict(type="end_game", winners=body[1])
+        raise RuntimeError(f"Unknown message kind {body[0]}")
+
     def run(self) -> None:
         """
         Run the bot until the game ends
@@ -104,27 +177,136 @@ class Bot:
             self.running = True
             while self.running:
                 # event = self.readline()
-                event = json.loads(self.recv())
+                event = self.recv_event()
                 if 'in' in self.logging_events:
-                    self.log(json.dumps(event))
+                    self.log(event)
                 getattr(self, f"on_{event['type']}_raw")(event)
 
     def on_initialize_raw(self, payload):
-        self.map = np.array(payload['map'])
+        self.map = decode_map(payload['map'])
+        self.passability = PassabilityMap(self.map)
+        self.resources = ResourceIndex(self.map)
         self.player_id = payload['player_id']
         self.num_players = payload['num_players']
         self.balance = payload['balance']
         self.costs = payload['costs']
+        self.home = tuple(payload['home'])
+        self.homes = {int(pid): tuple(home) for pid, home in payload.get('homes', {}).items()}
+        self.unit_stats = payload.get('unit_stats')
+        self.unit_types = payload.get('unit_types')
+        if payload.get('protocol') != "binary":
+            self.protocol = "json"  # Engines without the binary protocol don't send it
+        self._pathfinder = None
+        if self.precompute_paths:
+            self.pathfinder.precompute([*self.resources.nodes.tolist(), *self.homes.values()])
         self.on_game_initialize()
 
+    @property
+    def simulator(self) -> Simulator:
+        """Forward model with the game's rules, use `simulator.state_of(bot)` for a state to simulate from"""
+        if self._simulator is None:
+            self._simulator = Simulator.from_bot(self)
+        return self._simulator
+
+    @property
+    def pathfinder(self) -> Pathfinder:
+        """
+        Paths around impassable tiles, the flow field towards each destination is cached for the rest of the match.
+        Fields towards resource nodes and homes are built in the background from the start, see `precompute_paths`.
+        """
+        if self._pathfinder is None:
+            self._pathfinder = Pathfinder(self.map, self.passability)
+        return self._pathfinder
+
     def on_game_initialize(self):
         """Run when the initial payload is sent"""
 
-    def _update_state(self, newstate):
+    def _unit_data(self, unit_data):
+        """Unit dicts from either protocol, binary records are converted column by column"""
+        if isinstance(unit_data, np.ndarray):
+            return unit_dicts(unit_data, self.unit_types)
+        return unit_data
+
+    def _update_state(self, newstate, delta=False):
+        """
+        Reconcile the known units and groups with a part_start state by id. Existing objects are
+        updated in place, so anything a strategy stores on them is kept from part to part, only
+        new units get new objects. `spawned`, `died` and `moved` are set to what changed.
+        """
         self.balance = newstate['players'][str(self.player_id)]
         self.player_balances = newstate['players']
-        self._units = {data['id']: units.Unit(bot=self, **data) for data in newstate['units']}
-        self._groups = {data['id']: units.Group(bot=self, **data) for data in newstate['groups']}
+        if 'groups' in newstate:
+            self._update_groups(newstate['groups'])
+        self.spawned, self.died, self.moved = set(), set(), set()
+        if delta:
+            return self._apply_delta(newstate)
+
+        if isinstance(newstate['units'], np.ndarray):
+            self.unit_array = newstate['units']
+        unit_data = self._unit_data(newstate['units'])
+        for data in unit_data:
+            self._update_unit(data)
+        if len(self._units) > len(unit_data):
+            alive = {data['id'] for data in unit_data}
+            for uid in [uid for uid in self._units if uid not in alive]:
+                self._remove_unit(uid)
+        self._release_claims()
+
+    def _release_claims(self):
+        """Resource nodes claimed by units which are gone are free again"""
+        if self.died and self.resources is not None:
+            self.resources.release(self.died)
+
+    def _update_unit(self, data):
+        uid = data['id']
+        unit = self._units.get(uid)
+        if unit is None:
+            self._units[uid] = units.Unit(bot=self, **data)
+            self.spawned.add(uid)
+        else:
+            if data['position'] != self._positions.get(uid):
+                self.moved.add(uid)
+            unit.__dict__.update(data)
+        self._positions[uid] = data['position']
+
+    def _remove_unit(self, uid):
+        if self._units.pop(uid, None) is not None:
+            self.died.add(uid)
+        self._positions.pop(uid, None)
+
+    def _update_groups(self, group_data):
+        known, self._groups = self._groups, {}
+        for data in group_data:
+            group = known.get(data['id'])
+            if group is None:
+                group = units.Group(bot=self, **data)
+            else:
+                group.__dict__.update(data)
+            self._groups[data['id']] = group
+
+    def _apply_delta(self, newstate):
+        """
+        Update the known units in place from a delta part_start. Units the delta leaves out go back
+        to the last position the game sent, in case the bot moved them locally.
+        """
+        for uid in newstate['removed']:
+            self._remove_unit(uid)
+        for data in self._unit_data(newstate['spawned']):
+            self._update_unit(data)
+        for data in self._unit_data(newstate['changed']):
+            self._update_unit(data)
+        for uid, position in self._positions.items():
+            # Unit.move replaces the position, so a unit the bot didn't move still holds the game's
+            unit = self._units[uid]
+            if unit.position is not position:
+                unit.position = position
+        self._release_claims()
+
+        if self.unit_array is not None and isinstance(newstate['changed'], np.ndarray):
+            changed = np.concatenate([newstate['changed']['id'], np.asarray(newstate['removed'], dtype=np.int64)])
+            kept = self.unit_array[~np.isin(self.unit_array['id'], changed)]
+            unit_array = np.concatenate([kept, newstate['changed'], newstate['spawned']])
+            self.unit_array = unit_array[np.argsort(unit_array['id'], kind='stable')]
 
     def create_unit(self, type):
         #self.log(self.balance, self.costs[type])
@@ -139,6 +321,18 @@ class Bot:
 
         self.send(dict(command='spawn', unit_type=type))
         self.log("BUY AFTER BALANCE", self.balance)
+
+    def move_toward(self, units, destinations):
+        """Move each unit as far as possible along the shortest path to its destination, the waypoints of
+        all of them are found at once. See Unit.move_toward for a single unit."""
+        units = list(units)
+        if not units:
+            return
+        positions = [unit.position for unit in units]
+        waypoints = self.pathfinder.waypoints_to(positions, destinations, [unit.speed for unit in units])
+        for unit, position, waypoint in zip(units, positions, waypoints):
+            if tuple(waypoint) != tuple(position):
+                unit.move(waypoint)
     #
     # def create_group(self, position):
     #     self.send(dict(command='spawn'))
@@ -148,7 +342,7 @@ class Bot:
         sys.stderr.write(f"{self.player_id} {os.getpid()} {time.time()} STARTING PART {self.part} \r\n")
         sys.stderr.flush()
         self.turn = payload['turn']
-        self._update_state(payload['state'])
+        self._update_state(payload['state'], delta=payload.get('delta', False))
         getattr(self, f"on_{self.part}_start")()
 
     def on_attack_start(self):
@@ -0,0 +1,91 @@
+from collections import OrderedDict
+from typing import Tuple, Union
+
+import numpy as np
+
+IMPASSABLE_TILES = (1,)
+CACHE_SIZE = 4096  # segments remembered by each PassabilityMap
+
+
+def segment_tiles(starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Every tile crossed by each of a batch of segments, walked the same way as `raycast`.
+
+    A segment from tile center to tile center crosses one tile per x step and one per y step.
+    Where it passes exactly through a corner it steps diagonally, without touching the two side tiles.
+
+    :param starts: (n, 2) integer start tiles
+    :param ends: (n, 2) integer end tiles
+    :return: (segment, x, y) arrays with one entry per crossed tile. Tiles can repeat at corners.
+    """
+    starts = np.asarray(starts, dtype=np.int64).reshape(-1, 2)
+    ends = np.asarray(ends, dtype=np.int64).reshape(-1, 2)
+    delta = ends - starts
+    step = np.where(delta > 0, 1, -1)
+    dx, dy = np.abs(delta).T
+    count = len(starts)
+
+    def events(major, minor):
+        # For every crossing of a tile edge along the major axis, how far along each axis the walk is
+        segment = np.repeat(np.arange(count), major)
+        i = np.arange(len(segment)) - np.repeat(np.cumsum(major) - major, major)
+        along_major = i + 1
+        along_minor = ((2 * i + 1) * minor[segment] + major[segment]) // (2 * major[segment])
+        return segment, along_major, along_minor
+
+    x_segment, x_dx, x_dy = events(dx, dy)
+    y_segment, y_dy, y_dx = events(dy, dx)
+
+    segment = np.concatenate([np.arange(count), x_segment, y_segment])
+    offset_x = np.concatenate([np.zeros(count, dtype=np.int64), x_dx, y_dx])
+    offset_y = np.concatenate([np.zeros(count, dtype=np.int64), x_dy, y_dy])
+    xs = starts[segment, 0] + step[segment, 0] * offset_x
+    ys = starts[segment, 1] + step[segment, 1] * offset_y
+    return segment, xs, ys
+
+
+def raycast(start: Union[tuple[int, 2], np.ndarray], end: tuple[int, 2]) -> set[tuple]:
+    """
+    https://gamedev.stackexchange.com/questions/20103/finding-which-tiles-are-intersected-by-a-line-without-looping-through-all-of-th
+
+    :param start: Start position
+    :param end: End position
+    :return: List of intersecting tiles
+    """
+    _, xs, ys = segment_tiles(np.array([start]), np.array([end]))
+    return set(zip(xs.tolist(), ys.tolist()))
+
+
+class PassabilityMap(object):
+    """
+    Answers whether units can travel in a straight line between two tiles.
+
+    The blocked tiles are precomputed into a boolean bitmap once per map. Many segments
+    can be checked in one vectorized call, and the results of recent single segment checks
+    are kept in a bounded LRU cache keyed by (start, end).
+    """
+
+    def __init__(self, tiles: np.ndarray, impassable=IMPASSABLE_TILES, cache_size: int = CACHE_SIZE):
+        self.blocked = np.isin(tiles, impassable)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+
+    def are_clear(self, starts, ends) -> np.ndarray:
+        """Whether each segment avoids every blocked tile"""
+        starts = np.asarray(starts).reshape(-1, 2)
+        segment, xs, ys = segment_tiles(starts, ends)
+        hits = np.bincount(segment, weights=self.blocked[xs, ys], minlength=len(starts))
+        return hits == 0
+
+    def is_clear(self, start, end) -> bool:
+        """Whether a single segment avoids every blocked tile"""
+        key = (int(start[0]), int(start[1]), int(end[0]), int(end[1]))
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        clear = bool(self.are_clear([key[:2]], [key[2:]])[0])
+        self._cache[key] = clear
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return clear
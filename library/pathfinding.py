@@ -0,0 +1,256 @@
+"""
+Paths around impassable tiles, for bots.
+
+Units only move in straight lines, so getting around terrain means moving through waypoints.
+`Pathfinder.find_path` runs A* for a single trip. For targets many units head to, like resource
+nodes and homes, `Pathfinder.field` computes a flow field once per target and caches it for the
+match: the distance from every tile to the target and the neighbour to step to from each tile.
+`precompute` builds the fields of known targets on a background thread when the map arrives, so
+they are ready before the units need them. `next_waypoints` and `waypoints_to` then find the next
+waypoint of every unit at once by walking the fields.
+
+Paths step between the 8 neighbouring tiles, a diagonal step costs sqrt(2). A waypoint is the
+farthest tile along the path that a unit can reach in one move: within its speed and with no
+impassable tile on the straight line to it, so moving to it is always accepted by the game.
+"""
+import heapq
+import threading
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from library.passability import IMPASSABLE_TILES, PassabilityMap
+
+NEIGHBOURS = np.array([(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)])
+COSTS = np.hypot(*NEIGHBOURS.T)
+UNREACHABLE = np.inf
+
+
+class FlowField(object):
+    """
+    Distances to a set of target tiles from every tile, and the step towards the nearest
+    target from every tile, as (dx, dy). Targets and unreachable tiles step by (0, 0).
+    Kept compact as many are cached per match: float32 distances and int8 steps.
+    """
+
+    def __init__(self, blocked: np.ndarray, targets: np.ndarray):
+        self.targets = targets
+        distance = distance_map(blocked, targets)
+        self.step = descent_steps(distance)
+        self.distance = distance.astype(np.float32)
+
+    def reachable(self, positions) -> np.ndarray:
+        positions = np.asarray(positions).reshape(-1, 2)
+        return np.isfinite(self.distance[positions[:, 0], positions[:, 1]])
+
+    def walk(self, positions: np.ndarray, steps: int) -> np.ndarray:
+        """The next `steps` tiles along the field from each position, (n, steps, 2)"""
+        path, tile = [], positions
+        for _ in range(steps):
+            tile = tile + self.step[tile[:, 0], tile[:, 1]]
+            path.append(tile)
+        return np.stack(path, axis=1)
+
+
+def _shifted(padded: np.ndarray, shape, offset) -> np.ndarray:
+    """View of a grid padded by one tile, shifted so each tile sees its neighbour at offset"""
+    dx, dy = offset
+    return padded[1 + dx:1 + dx + shape[0], 1 + dy:1 + dy + shape[1]]
+
+
+def distance_map(blocked: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    """
+    Path length from every tile to the nearest of the targets, UNREACHABLE for blocked tiles and
+    tiles cut off from every target. Computed by sweeping the grid row by row downwards and upwards,
+    then column by column left and right, relaxing each row against the one before it, until a round
+    of sweeps changes nothing. Each sweep carries distances across the whole map in one direction,
+    so only paths that turn around obstacles need more than one round.
+    """
+    distance = np.full(blocked.shape, UNREACHABLE)
+    targets = np.asarray(targets, dtype=np.int64).reshape(-1, 2)
+    distance[targets[:, 0], targets[:, 1]] = 0
+    # Stepping onto a blocked tile costs UNREACHABLE, so blocked tiles are never relaxed
+    penalty = np.where(blocked, UNREACHABLE, 0)
+    distance += penalty
+    straight, diagonal = penalty + COSTS[1], penalty + COSTS[0]
+
+    while True:
+        before = distance.copy()
+        # Transposed views sweep the columns in place
+        for grid, straight_cost, diagonal_cost in ((distance, straight, diagonal), (distance.T, straight.T, diagonal.T)):
+            for rows, previous in ((range(1, len(grid)), -1), (range(len(grid) - 2, -1, -1), 1)):
+                for i in rows:
+                    last, row = grid[i + previous], grid[i]
+                    np.minimum(row, last + straight_cost[i], out=row)
+                    np.minimum(row[1:], last[:-1] + diagonal_cost[i, 1:], out=row[1:])
+                    np.minimum(row[:-1], last[1:] + diagonal_cost[i, :-1], out=row[:-1])
+        if np.array_equal(before, distance):
+            return distance
+
+
+def descent_steps(distance: np.ndarray) -> np.ndarray:
+    """For every tile, the offset of the neighbour with the shortest way to the target, (0, 0) where there is none"""
+    padded = np.full((distance.shape[0] + 2, distance.shape[1] + 2), UNREACHABLE)
+    padded[1:-1, 1:-1] = distance
+    through = np.stack([_shifted(padded, distance.shape, offset) + cost for offset, cost in zip(NEIGHBOURS, COSTS)])
+    steps = NEIGHBOURS.astype(np.int8)[through.argmin(axis=0)]
+    steps[(distance == 0) | ~np.isfinite(distance)] = 0
+    return steps
+
+
+class Pathfinder(object):
+    """Shortest paths on a tile map, with flow fields cached per target for the whole match"""
+
+    def __init__(self, tiles: np.ndarray, passability: PassabilityMap = None, impassable=IMPASSABLE_TILES):
+        self.blocked = np.isin(tiles, impassable)
+        self.passability = passability if passability is not None else PassabilityMap(tiles, impassable)
+        self.fields = {}
+        self._lock = threading.Lock()  # Fields are built by one thread at a time, see `precompute`
+
+    @staticmethod
+    def _key(targets) -> tuple:
+        return tuple(sorted(map(tuple, np.asarray(targets, dtype=np.int64).reshape(-1, 2).tolist())))
+
+    def field(self, targets) -> FlowField:
+        """
+        Flow field towards a target tile, or towards the nearest of several target tiles.
+        Computed on first use, unless `precompute` already did, and kept for the rest of the match.
+        """
+        key = self._key(targets)
+        field = self.fields.get(key)
+        if field is None:
+            with self._lock:
+                field = self.fields.get(key)
+                if field is None:
+                    field = self.fields[key] = FlowField(self.blocked, np.array(key))
+        return field
+
+    def precompute(self, targets) -> threading.Thread:
+        """
+        Build the flow field of each target tile on a background thread. A field asked for before
+        the thread gets to it is built right away by `field` instead.
+        """
+        targets = np.asarray(targets, dtype=np.int64).reshape(-1, 2)
+        thread = threading.Thread(target=lambda: [self.field(target) for target in targets], daemon=True,
+                                  name="flow fields")
+        thread.start()
+        return thread
+
+    def find_path(self, start, goal) -> Optional[List[Tuple[int, int]]]:
+        """A* from start to goal, every tile of the path including both ends. None if the goal can't be reached."""
+        start, goal = tuple(int(v) for v in start), tuple(int(v) for v in goal)
+        if self.blocked[goal] or self.blocked[start]:
+            return None
+        width, height = self.blocked.shape
+
+        def heuristic(tile):
+            # Octile distance, exact on an empty map
+            dx, dy = abs(tile[0] - goal[0]), abs(tile[1] - goal[1])
+            return max(dx, dy) + (COSTS[0] - 1) * min(dx, dy)
+
+        came_from = {start: None}
+        cost = {start: 0.0}
+        frontier = [(heuristic(start), 0.0, start)]
+        while frontier:
+            _, so_far, tile = heapq.heappop(frontier)
+            if tile == goal:
+                path = []
+                while tile is not None:
+                    path.append(tile)
+                    tile = came_from[tile]
+                return path[::-1]
+            if so_far > cost[tile]:
+                continue
+            for (dx, dy), step in zip(NEIGHBOURS.tolist(), COSTS.tolist()):
+                neighbour = tile[0] + dx, tile[1] + dy
+                if not (0 <= neighbour[0] < width and 0 <= neighbour[1] < height) or self.blocked[neighbour]:
+                    continue
+                total = so_far + step
+                if total < cost.get(neighbour, UNREACHABLE):
+                    cost[neighbour] = total
+                    came_from[neighbour] = tile
+                    heapq.heappush(frontier, (total + heuristic(neighbour), total, neighbour))
+        return None
+
+    def farthest_reachable(self, starts, paths: np.ndarray, speeds) -> np.ndarray:
+        """
+        For each start, the last tile of its path it can move to in one straight move of at most its speed.
+
+        :param starts: (n, 2) tiles the units are on
+        :param paths: (n, steps, 2) tiles along each unit's path, starting with the next tile after its start
+        :param speeds: speed of each unit, or one speed for all
+        :return: (n, 2) waypoints, the start itself where not even the first tile can be reached
+        """
+        starts = np.asarray(starts, dtype=np.int64).reshape(-1, 2)
+        paths = np.concatenate([starts[:, None], np.asarray(paths, dtype=np.int64).reshape(len(starts), -1, 2)], axis=1)
+        speeds = np.broadcast_to(np.asarray(speeds, dtype=float), len(starts))
+
+        reachable = np.hypot(*(paths - starts[:, None]).transpose(2, 0, 1)) <= speeds[:, None]
+        candidates = np.flatnonzero(reachable)
+        clear = self.passability.are_clear(np.repeat(starts, paths.shape[1], axis=0)[candidates],
+                                           paths.reshape(-1, 2)[candidates])
+        reachable.ravel()[candidates[~clear]] = False
+        reachable[:, 0] = True
+        last = paths.shape[1] - 1 - reachable[:, ::-1].argmax(axis=1)
+        return paths[np.arange(len(starts)), last]
+
+    @staticmethod
+    def _steps(speeds: np.ndarray) -> int:
+        # Walk a bit further than a straight path could get in one move, paths around terrain bend
+        return int(np.ceil(speeds.max(initial=0) * COSTS[0]))
+
+    def next_waypoints(self, positions, targets, speeds) -> np.ndarray:
+        """
+        Next waypoint of every unit on its way to the target (or the nearest of several targets), by
+        walking the target's flow field. Units which can't reach the target stay where they are.
+
+        :param positions: (n, 2) positions of the units
+        :param speeds: speed of each unit, or one speed for all
+        :return: (n, 2) waypoints
+        """
+        positions = np.asarray(positions, dtype=np.int64).reshape(-1, 2)
+        speeds = np.asarray(speeds, dtype=float)
+        steps = self._steps(speeds)
+        if not len(positions) or not steps:
+            return positions
+        return self.farthest_reachable(positions, self.field(targets).walk(positions, steps), speeds)
+
+    def waypoints_to(self, positions, destinations, speeds) -> np.ndarray:
+        """
+        Next waypoint of every unit on its way to its own destination, one flow field walk per distinct
+        destination and a single passability check for all of them. Units which can't reach their
+        destination stay where they are.
+
+        :param positions: (n, 2) positions of the units
+        :param destinations: (n, 2) destination of each unit
+        :param speeds: speed of each unit, or one speed for all
+        :return: (n, 2) waypoints
+        """
+        positions = np.asarray(positions, dtype=np.int64).reshape(-1, 2)
+        destinations = np.asarray(destinations, dtype=np.int64).reshape(-1, 2)
+        speeds = np.asarray(speeds, dtype=float)
+        steps = self._steps(speeds)
+        if not len(positions) or not steps:
+            return positions
+
+        paths = np.empty((len(positions), steps, 2), dtype=np.int64)
+        unique, group = np.unique(destinations, axis=0, return_inverse=True)
+        group = group.reshape(-1)
+        for index, destination in enumerate(unique):
+            members = np.flatnonzero(group == index)
+            paths[members] = self.field(destination).walk(positions[members], steps)
+        return self.farthest_reachable(positions, paths, speeds)
+
+    def waypoint(self, start, goal, speed) -> Optional[np.ndarray]:
+        """Next waypoint of a single unit on the A* path to the goal, None if the goal can't be reached"""
+        path = self.find_path(start, goal)
+        if path is None:
+            return None
+        if len(path) == 1:
+            return np.array(path[0])
+        return self.farthest_reachable([start], np.array([path[1:]]), speed)[0]
+
+    def distances(self, positions, targets) -> np.ndarray:
+        """Path length from each position to the target (or the nearest of several), UNREACHABLE if cut off"""
+        positions = np.asarray(positions, dtype=np.int64).reshape(-1, 2)
+        return self.field(targets).distance[positions[:, 0], positions[:, 1]]
@@ -0,0 +1,278 @@
+"""
+Binary wire protocol, an alternative to newline separated JSON.
+
+Bots ask for it in their hello (`protocol="binary"`). The game still sends the initialize
+message as a JSON line, with the protocol it agreed to and the `unit_types` enum, and every
+message after that in either direction is a binary frame: a little endian uint32 length
+followed by that many bytes. The first byte of a frame is its message kind.
+
+part_start: header, then one record per player, then a count and the packed UNIT_DTYPE
+records of every unit, then a count and every group (id, owner, member count, member ids).
+part_delta: the same header and player records, then counted UNIT_DTYPE records of the spawned
+units, of the changed units and the counted ids of the removed units, then a flag byte and, if
+it is set, the groups as in part_start.
+end_game: header with the winner's id.
+command: header with turn, part and command enums, then the command's arguments.
+
+The map in the initialize message is a nested JSON list unless the bot asks for a compact
+`map_encoding` in its hello (see `encode_map`).
+"""
+import base64
+import struct
+from typing import List, Tuple
+
+import numpy as np
+
+PROTOCOLS = ("json", "binary")
+MAP_ENCODINGS = ("list", "raw", "rle")
+MAP_DTYPE = np.dtype('u1')
+RUN_LENGTH_DTYPE = np.dtype('<u4')
+
+PARTS = ("attack", "move", "collect", "spawn")
+COMMANDS = ("attack", "move", "collect", "spawn", "end_attack", "end_move", "end_collect", "end_spawn")
+RESOURCES = ("wood", "metal")
+
+PART_START, END_GAME, COMMAND, PART_DELTA = 1, 2, 3, 4
+
+NO_VIEW_RANGE = -1  # view_range of units without one (None)
+
+UNIT_DTYPE = np.dtype([
+    ('id', '<i8'),
+    ('owner', '<i2'),
+    ('type', '<u1'),
+    ('speed', '<i4'),
+    ('health', '<i4'),
+    ('attack', '<i4'),
+    ('defense', '<i4'),
+    ('attack_range', '<i4'),
+    ('view_range', '<i4'),
+    ('collect_amount', '<i4'),
+    ('position', '<i4', (2,)),
+])
+
+FRAME = struct.Struct('<I')
+PART_START_HEADER = struct.Struct('<BIBB')  # kind, turn, part, player count
+PLAYER_RECORD = struct.Struct('<B' + 'q' * len(RESOURCES))  # player id, balance of each resource
+COUNT = struct.Struct('<I')
+FLAG = struct.Struct('<B')
+GROUP_HEADER = struct.Struct('<qBI')  # id, owner, member count
+END_GAME_HEADER = struct.Struct('<BB')  # kind, winner
+COMMAND_HEADER = struct.Struct('<BIBB')  # kind, turn, part, command
+COMMAND_ARGS = {
+    'attack': struct.Struct('<qq'),  # unit, target
+    'move': struct.Struct('<qqq'),  # unit, x, y
+    'collect': struct.Struct('<q'),  # unit
+    'spawn': struct.Struct('<B'),  # unit type
+}
+
+
+def frame(body: bytes) -> bytes:
+    return FRAME.pack(len(body)) + body
+
+
+def _pack_header(kind: int, turn: int, part: str, players: dict) -> List[bytes]:
+    chunks = [PART_START_HEADER.pack(kind, turn, PARTS.index(part), len(players))]
+    for player_id, balance in players.items():
+        chunks.append(PLAYER_RECORD.pack(int(player_id), *(balance.get(name, 0) for name in RESOURCES)))
+    return chunks
+
+
+def _pack_records(records: np.ndarray, dtype=UNIT_DTYPE) -> List[bytes]:
+    return [COUNT.pack(len(records)), np.asarray(records).astype(dtype, copy=False).tobytes()]
+
+
+def _pack_groups(groups: List[dict]) -> List[bytes]:
+    chunks = [COUNT.pack(len(groups))]
+    for group in groups:
+        chunks.append(GROUP_HEADER.pack(group['id'], group['owner'], len(group['members'])))
+        chunks.append(np.asarray(group['members'], dtype='<i8').tobytes())
+    return chunks
+
+
+def encode_part_start(turn: int, part: str, units: np.ndarray, groups: List[dict], players: dict) -> bytes:
+    """Encode a part_start frame, `units` being an array of UNIT_DTYPE records"""
+    chunks = _pack_header(PART_START, turn, part, players) + _pack_records(units) + _pack_groups(groups)
+    return frame(b"".join(chunks))
+
+
+def encode_part_delta(turn: int, part: str, spawned: np.ndarray, changed: np.ndarray, removed: np.ndarray,
+                      groups: List[dict], players: dict) -> bytes:
+    """Encode a part_delta frame. `groups` is None when they didn't change since the previous part."""
+    chunks = _pack_header(PART_DELTA, turn, part, players)
+    chunks += _pack_records(spawned) + _pack_records(changed) + _pack_records(removed, '<i8')
+    if groups is None:
+        chunks.append(FLAG.pack(0))
+    else:
+        chunks += [FLAG.pack(1)] + _pack_groups(groups)
+    return frame(b"".join(chunks))
+
+
+class _Unpacker(object):
+    """Reads the pieces of a part_start or part_delta body in order"""
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.offset = 0
+
+    def unpack(self, fmt: struct.Struct) -> tuple:
+        values = fmt.unpack_from(self.body, self.offset)
+        self.offset += fmt.size
+        return values
+
+    def header(self) -> Tuple[int, str, dict]:
+        _, turn, part, player_count = self.unpack(PART_START_HEADER)
+        players = {}
+        for _ in range(player_count):
+            player_id, *balance = self.unpack(PLAYER_RECORD)
+            players[str(player_id)] = dict(zip(RESOURCES, balance))
+        return turn, PARTS[part], players
+
+    def records(self, dtype=UNIT_DTYPE) -> np.ndarray:
+        count, = self.unpack(COUNT)
+        records = np.frombuffer(self.body, dtype=dtype, count=count, offset=self.offset)
+        self.offset += count * records.itemsize
+        return records
+
+    def groups(self) -> List[dict]:
+        count, = self.unpack(COUNT)
+        groups = []
+        for _ in range(count):
+            group_id, owner, member_count = self.unpack(GROUP_HEADER)
+            members = np.frombuffer(self.body, dtype='<i8', count=member_count, offset=self.offset).tolist()
+            self.offset += member_count * 8
+            groups.append(dict(id=group_id, owner=owner, members=members))
+        return groups
+
+
+def decode_part_start(body: bytes) -> dict:
+    """Decode a part_start frame body into the same message as JSON, with units left as UNIT_DTYPE records"""
+    unpacker = _Unpacker(body)
+    turn, part, players = unpacker.header()
+    state = dict(units=unpacker.records(), groups=unpacker.groups(), players=players)
+    return dict(type="part_start", turn=turn, part=part, state=state)
+
+
+def decode_part_delta(body: bytes) -> dict:
+    """Decode a part_delta frame body into the same message as JSON, with units left as UNIT_DTYPE records"""
+    unpacker = _Unpacker(body)
+    turn, part, players = unpacker.header()
+    state = dict(spawned=unpacker.records(), changed=unpacker.records(), removed=unpacker.records('<i8').tolist(),
+                 players=players)
+    if unpacker.unpack(FLAG)[0]:
+        state['groups'] = unpacker.groups()
+    return dict(type="part_start", turn=turn, part=part, delta=True, state=state)
+
+
+def unit_dicts(units: np.ndarray, unit_types: List[str]) -> List[dict]:
+    """Turn UNIT_DTYPE records into the unit dicts of the JSON protocol, column by column"""
+    type_names = np.array(unit_types, dtype=object)
+    view_range = units['view_range'].astype(object)
+    view_range[view_range == NO_VIEW_RANGE] = None
+    columns = dict(
+        id=units['id'].tolist(),
+        owner=units['owner'].tolist(),
+        type=type_names[units['type']].tolist(),
+        speed=units['speed'].tolist(),
+        health=units['health'].tolist(),
+        attack=units['attack'].tolist(),
+        defense=units['defense'].tolist(),
+        attack_range=units['attack_range'].tolist(),
+        view_range=view_range.tolist(),
+        collect_amount=units['collect_amount'].tolist(),
+        position=units['position'].tolist(),
+    )
+    return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+
+def encode_end_game(winner: int) -> bytes:
+    return frame(END_GAME_HEADER.pack(END_GAME, winner))
+
+
+def encode_command(payload: dict, unit_types: List[str]) -> bytes:
+    """Encode a command as sent by `Bot.send` into a frame"""
+    command = payload['command']
+    body = COMMAND_HEADER.pack(COMMAND, payload['turn'], PARTS.index(payload['part']), COMMANDS.index(command))
+    if command == 'attack':
+        body += COMMAND_ARGS[command].pack(payload['unit'], payload['target'])
+    elif command == 'move':
+        body += COMMAND_ARGS[command].pack(payload['unit'], *payload['destination'])
+    elif command == 'collect':
+        body += COMMAND_ARGS[command].pack(payload['unit'])
+    elif command == 'spawn':
+        body += COMMAND_ARGS[command].pack(unit_types.index(payload['unit_type']))
+    return frame(body)
+
+
+def decode_command(body: bytes, unit_types: List[str]) -> dict:
+    """Decode a command frame body into the same dict the JSON protocol carries"""
+    _, turn, part, command = COMMAND_HEADER.unpack_from(body)
+    command = COMMANDS[command]
+    payload = dict(command=command, turn=turn, part=PARTS[part])
+    if command in COMMAND_ARGS:
+        args = COMMAND_ARGS[command].unpack_from(body, COMMAND_HEADER.size)
+        if command == 'attack':
+            payload.update(unit=args[0], target=args[1])
+        elif command == 'move':
+            payload.update(unit=args[0], destination=list(args[1:]))
+        elif command == 'collect':
+            payload.update(unit=args[0])
+        else:
+            payload.update(unit_type=unit_types[args[0]])
+    return payload
+
+
+def encode_map(tiles: np.ndarray, encoding: str = "raw"):
+    """
+    Encode the map for the initialize message.
+
+    - list: the nested list of tile values
+    - raw: dict(encoding, shape, dtype, data), data being the base64 encoded uint8 tiles in C order
+    - rle: the same dict, data holding the value of every run followed by the uint32 length of every run
+    """
+    if encoding == "list":
+        return np.asarray(tiles).tolist()
+
+    tiles = np.ascontiguousarray(tiles, dtype=MAP_DTYPE)
+    payload = dict(encoding=encoding, shape=list(tiles.shape), dtype=MAP_DTYPE.str)
+    if encoding == "raw":
+        data = tiles.tobytes()
+    elif encoding == "rle":
+        flat = tiles.ravel()
+        starts = np.flatnonzero(np.concatenate([[True], flat[1:] != flat[:-1]]))
+        lengths = np.diff(np.append(starts, len(flat))).astype(RUN_LENGTH_DTYPE)
+        data = flat[starts].tobytes() + lengths.tobytes()
+        payload['runs'] = len(starts)
+    else:
+        raise RuntimeError(f"Invalid map encoding {encoding}, expected one of {MAP_ENCODINGS}")
+    payload['data'] = base64.b64encode(data).decode('ascii')
+    return payload
+
+
+def decode_map(payload) -> np.ndarray:
+    """
+    Decode the map of the initialize message, whichever encoding it was sent in.
+    Raw maps are read straight from the decoded buffer without copying, so the array is read only.
+    """
+    if not isinstance(payload, dict):
+        return np.asarray(payload)
+
+    data = base64.b64decode(payload['data'])
+    dtype = np.dtype(payload['dtype'])
+    if payload['encoding'] == "raw":
+        return np.frombuffer(data, dtype=dtype).reshape(payload['shape'])
+
+    runs = payload['runs']
+    values = np.frombuffer(data, dtype=dtype, count=runs)
+    lengths = np.frombuffer(data, dtype=RUN_LENGTH_DTYPE, count=runs, offset=runs * dtype.itemsize)
+    return np.repeat(values, lengths).reshape(payload['shape'])
+
+
+def split_frame(buffer: bytes) -> Tuple[bytes, bytes]:
+    """Split one complete frame body off the front of a buffer, (None, buffer) if it isn't all there yet"""
+    if len(buffer) < FRAME.size:
+        return None, buffer
+    length, = FRAME.unpack_from(buffer)
+    end = FRAME.size + length
+    if len(buffer) < end:
+        return None, buffer
+    return buffer[FRAME.size:end], buffer[end:]
@@ -0,0 +1,117 @@
+"""
+Index of the resource nodes on the map, for bots.
+
+The nodes are found once, when the map arrives, and queries work on every gatherer at once:
+`nearest` gives each position its k nearest nodes, `assign` hands each gatherer its own nearest
+unclaimed node. Claims are optional, they let several gatherers be spread over the nodes
+instead of all walking to the same one, and are released when a claimant dies.
+Nodes are referred to by their index in `nodes`.
+"""
+from typing import Iterable, Union
+
+import numpy as np
+
+WOOD, METAL = 3, 4
+RESOURCE_TILES = {WOOD: "wood", METAL: "metal"}
+
+
+class ResourceIndex(object):
+    """Positions of the resource nodes of a map, by resource type, with claims on them"""
+
+    def __init__(self, tiles: np.ndarray):
+        tiles = np.asarray(tiles)
+        self.nodes = np.argwhere(np.isin(tiles, list(RESOURCE_TILES)))  # (n, 2) positions in row major order
+        self.kinds = tiles[self.nodes[:, 0], self.nodes[:, 1]]  # Tile value of each node
+        self.by_type = {tile: np.flatnonzero(self.kinds == tile) for tile in RESOURCE_TILES}
+        self.claims = {}  # Node index -> claimant
+        self.claimed = {}  # Claimant -> node index
+
+    def __len__(self):
+        return len(self.nodes)
+
+    @staticmethod
+    def _tile(resource: Union[int, str]) -> int:
+        """Resource as a tile value, given either the value (3, 4) or the name ("wood", "metal")"""
+        if isinstance(resource, str):
+            for tile, name in RESOURCE_TILES.items():
+                if name == resource:
+                    return tile
+            raise RuntimeError(f"Invalid resource {resource}")
+        return int(resource)
+
+    def candidates(self, resource: Union[int, str] = None, unclaimed: bool = False) -> np.ndarray:
+        """Indexes of the nodes of a resource (any resource if None), optionally only the unclaimed ones"""
+        nodes = np.arange(len(self.nodes)) if resource is None else self.by_type.get(self._tile(resource))
+        if nodes is None:
+            raise RuntimeError(f"Invalid resource {resource}")
+        if unclaimed and self.claims:
+            nodes = nodes[~np.isin(nodes, list(self.claims))]
+        return nodes
+
+    def _distances(self, positions, nodes: np.ndarray) -> np.ndarray:
+        """Squared distance from every position to every node, (positions, nodes)"""
+        diff = np.asarray(positions, dtype=np.int64).reshape(-1, 1, 2) - self.nodes[nodes][None]
+        return (diff ** 2).sum(axis=2)
+
+    def nearest(self, positions, k: int = 1, resource: Union[int, str] = None, unclaimed: bool = False) -> np.ndarray:
+        """
+        Indexes of the k nodes nearest to each of the positions, nearest first. Rows are padded
+        with -1 where there are fewer than k nodes to pick from.
+
+        :return: (positions, k) array of node indexes
+        """
+        positions = np.asarray(positions).reshape(-1, 2)
+        nodes = self.candidates(resource, unclaimed)
+        result = np.full((len(positions), k), -1, dtype=np.int64)
+        if len(nodes) and len(positions):
+            order = np.argsort(self._distances(positions, nodes), axis=1, kind='stable')[:, :k]
+            result[:, :order.shape[1]] = nodes[order]
+        return result
+
+    def assign(self, claimants: Iterable, positions, resource: Union[int, str] = None) -> np.ndarray:
+        """
+        Claim a node for each claimant that doesn't hold one yet, the closest claimant and node
+        pairs first, so no two claimants share a node. Claimants keep the node they already hold.
+
+        :return: The node index held by each claimant, -1 for those left without one
+        """
+        claimants = list(claimants)
+        positions = np.asarray(positions).reshape(-1, 2)
+        result = np.array([self.claimed.get(claimant, -1) for claimant in claimants], dtype=np.int64)
+        waiting = np.flatnonzero(result < 0)
+        nodes = self.candidates(resource, unclaimed=True)
+        if not len(waiting) or not len(nodes):
+            return result
+
+        distances = self._distances(positions[waiting], nodes)
+        rows, columns = np.unravel_index(np.argsort(distances, axis=None, kind='stable'), distances.shape)
+        taken_rows, taken_columns = set(), set()
+        for row, column in zip(rows.tolist(), columns.tolist()):
+            if row in taken_rows or column in taken_columns:
+                continue
+            taken_rows.add(row)
+            taken_columns.add(column)
+            result[waiting[row]] = nodes[column]
+            self.claim(claimants[waiting[row]], nodes[column])
+            if len(taken_rows) == len(waiting) or len(taken_columns) == len(nodes):
+                break
+        return result
+
+    def claim(self, claimant, node: int) -> None:
+        """Claim a node, replacing any claim the claimant already holds"""
+        if self.claims.get(node, claimant) != claimant:
+            raise RuntimeError(f"Node {node} is already claimed by {self.claims[node]}")
+        self.release([claimant])
+        self.claims[int(node)] = claimant
+        self.claimed[claimant] = int(node)
+
+    def release(self, claimants: Iterable) -> None:
+        """Give up the claims of the given claimants"""
+        for claimant in claimants:
+            node = self.claimed.pop(claimant, None)
+            if node is not None:
+                del self.claims[node]
+
+    def claim_of(self, claimant) -> int:
+        """Node index claimed by the claimant, -1 if it holds none"""
+        return self.claimed.get(claimant, -1)
@@ -0,0 +1,212 @@
+"""
+Forward model of the game for bots.
+
+`Simulator` applies commands to a `SimState` with the same rules as the engine's `GameRound`,
+so a bot can try out attacks, moves, collections and purchases before sending them, or roll
+a part forward many times. States are a UNIT_DTYPE record array plus a balance array, copying
+one for another rollout is two array copies.
+
+Commands the engine would reject are skipped rather than raised (in a real match they would
+end the game), each method returns a mask of the commands that were carried out.
+"""
+from typing import Dict, List
+
+import numpy as np
+
+from library.passability import PassabilityMap
+from library.protocol import NO_VIEW_RANGE, PARTS, RESOURCES, UNIT_DTYPE
+from library.resources import RESOURCE_TILES
+
+
+class SimState(object):
+    """
+    Units as UNIT_DTYPE records in id order and every player's balance, one row per player
+    id and one column per resource in RESOURCES.
+    """
+    __slots__ = ('units', 'balances', 'next_id')
+
+    def __init__(self, units: np.ndarray, balances: np.ndarray, next_id: int = None):
+        self.units = units
+        self.balances = balances
+        # The engine numbers units with a counter the bots don't see, new units get the next id after the known ones
+        self.next_id = int(units['id'].max(initial=-1)) + 1 if next_id is None else next_id
+
+    def copy(self) -> 'SimState':
+        return SimState(self.units.copy(), self.balances.copy(), self.next_id)
+
+    def rows_of(self, ids) -> np.ndarray:
+        """Rows of the units with the given ids, -1 for ids which aren't in the state"""
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(self.units):
+            return np.full(len(ids), -1, dtype=np.int64)
+        rows = np.searchsorted(self.units['id'], ids)
+        rows = np.minimum(rows, len(self.units) - 1)
+        found = self.units['id'][rows] == ids
+        return np.where(found, rows, -1)
+
+    def balance(self, player_id: int) -> dict:
+        return dict(zip(RESOURCES, self.balances[player_id].tolist()))
+
+    def owned_by(self, player_id: int) -> np.ndarray:
+        return self.units[self.units['owner'] == player_id]
+
+
+class Simulator(object):
+    """The engine's rules, applied to a SimState in place"""
+
+    def __init__(self, map: np.ndarray, costs: dict, unit_stats: dict, unit_types: List[str], homes: dict,
+                 passability: PassabilityMap = None):
+        self.map = map
+        self.passability = passability if passability is not None else PassabilityMap(map)
+        self.costs = costs
+        self.unit_stats = unit_stats
+        self.unit_types = list(unit_types)
+        self.homes = homes
+
+    @classmethod
+    def from_bot(cls, bot) -> 'Simulator':
+        return cls(bot.map, bot.costs, bot.unit_stats, bot.unit_types, bot.homes, bot.passability)
+
+    def state_of(self, bot) -> SimState:
+        """The bot's current view of the game as a state to simulate from"""
+        units = bot.unit_array
+        if units is None:
+            units = np.array([
+                (unit.id, unit.owner, self.unit_types.index(unit.type), unit.speed, unit.health, unit.attack,
+                 unit.defense, unit.attack_range, NO_VIEW_RANGE if unit.view_range is None else unit.view_range,
+                 unit.collect_amount, tuple(unit.position))
+                for unit in sorted(bot.units, key=lambda unit: unit.id)
+            ], dtype=UNIT_DTYPE)
+        else:
+            units = units.copy()
+
+        balances = np.zeros((bot.num_players, len(RESOURCES)), dtype=np.int64)
+        for player_id, balance in bot.player_balances.items():
+            balances[int(player_id)] = [balance.get(name, 0) for name in RESOURCES]
+        return SimState(units, balances)
+
+    def start_round(self, state: SimState) -> None:
+        """Every player earns one of each resource at the start of a round"""
+        state.balances += 1
+
+    def attack(self, state: SimState, owners, attackers, targets) -> np.ndarray:
+        """
+        Attack commands of a whole attack part, given as parallel arrays of the commanding player,
+        the attacking unit id and the target id. Units left without health are removed afterwards.
+        """
+        owners, arows, trows = self._commands(state, owners, attackers, targets)
+        if not len(state.units):
+            return np.zeros(len(owners), dtype=bool)
+        units = state.units
+        valid = (arows >= 0) & (trows >= 0)
+        valid[valid] = units['owner'][arows[valid]] == owners[valid]
+        valid[valid] = units['owner'][trows[valid]] != owners[valid]
+        valid &= self._first(arows)
+        distance = np.hypot(*(units['position'][arows] - units['position'][trows]).T.astype(float))
+        valid &= distance <= units['attack_range'][arows]
+
+        np.add.at(units['health'], trows[valid], -units['attack'][arows[valid]])
+        state.units = units[units['health'] > 0]
+        return valid
+
+    def move(self, state: SimState, owners, unit_ids, destinations) -> np.ndarray:
+        """Move commands, each unit goes as far as its speed allows towards its destination"""
+        owners, rows = self._commands(state, owners, unit_ids)
+        if not len(state.units):
+            return np.zeros(len(owners), dtype=bool)
+        destinations = np.asarray(destinations, dtype=np.int64).reshape(-1, 2)
+        units = state.units
+        valid = (rows >= 0) & self._first(rows)
+        valid[valid] = units['owner'][rows[valid]] == owners[valid]
+        valid &= (destinations >= 0).all(axis=1) & (destinations < self.map.shape).all(axis=1)
+
+        positions = units['position'][rows]
+        diff = (destinations - positions).astype(float)
+        distance = np.hypot(*diff.T)
+        speed = units['speed'][rows]
+        far = distance > speed
+        diff[far] *= (speed[far] / distance[far])[:, None]
+        ends = (positions + diff).astype(int)
+        valid[valid] = self.passability.are_clear(positions[valid], ends[valid])
+
+        units['position'][rows[valid]] = ends[valid]
+        return valid
+
+    def collect(self, state: SimState, owners, unit_ids) -> np.ndarray:
+        """Collect commands, each player can only collect each resource tile once a part"""
+        owners, rows = self._commands(state, owners, unit_ids)
+        if not len(state.units):
+            return np.zeros(len(owners), dtype=bool)
+        units = state.units
+        valid = (rows >= 0) & self._first(rows)
+        valid[valid] = units['owner'][rows[valid]] == owners[valid]
+        x, y = units['position'][rows].T
+        tiles = self.map[x, y]
+        valid &= np.isin(tiles, list(RESOURCE_TILES))
+        # The first collection on a tile by each player counts, later ones are rejected
+        keys = np.stack([owners, x, y], axis=1)[valid]
+        first = np.zeros(len(keys), dtype=bool)
+        first[np.unique(keys, axis=0, return_index=True)[1]] = True
+        valid[valid] = first
+
+        for tile, name in RESOURCE_TILES.items():
+            picked = valid & (tiles == tile)
+            np.add.at(state.balances[:, RESOURCES.index(name)], owners[picked], units['collect_amount'][rows[picked]])
+        return valid
+
+    def spawn(self, state: SimState, player_id: int, unit_types: List[str]) -> np.ndarray:
+        """Buy units in order, each spawns at the player's home if the player can afford it"""
+        valid = np.zeros(len(unit_types), dtype=bool)
+        new = []
+        for index, unit_type in enumerate(unit_types):
+            cost = np.array([self.costs.get(unit_type, {}).get(name, 0) for name in RESOURCES])
+            if unit_type not in self.costs or (state.balances[player_id] < cost).any():
+                continue
+            state.balances[player_id] -= cost
+            stats = self.unit_stats[unit_type]
+            view_range = NO_VIEW_RANGE if stats['view_range'] is None else stats['view_range']
+            new.append((state.next_id, player_id, self.unit_types.index(unit_type), stats['speed'], stats['health'],
+                        stats['attack'], stats['defense'], stats['attack_range'], view_range,
+                        stats['collect_amount'], tuple(self.homes[player_id])))
+            state.next_id += 1
+            valid[index] = True
+
+        if new:
+            state.units = np.concatenate([state.units, np.array(new, dtype=UNIT_DTYPE)])
+        return valid
+
+    def play_part(self, state: SimState, part: str, commands: Dict[int, List[dict]]) -> None:
+        """
+        Carry out a part's commands, given per player as the dicts bots send, in the order the
+        engine dispatches them.
+        """
+        if part not in PARTS:
+            raise RuntimeError(f"Invalid part {part}")
+        if part == "spawn":
+            for player_id, player_commands in commands.items():
+                self.spawn(state, player_id, [c['unit_type'] for c in player_commands if c['command'] == "spawn"])
+            return
+
+        owners, args = [], []
+        for player_id, player_commands in commands.items():
+            for command in player_commands:
+                if command['command'] == part:
+                    owners.append(player_id)
+                    args.append(command)
+        if part == "attack":
+            self.attack(state, owners, [c['unit'] for c in args], [c['target'] for c in args])
+        elif part == "move":
+            self.move(state, owners, [c['unit'] for c in args], [c['destination'] for c in args])
+        else:
+            self.collect(state, owners, [c['unit'] for c in args])
+
+    @staticmethod
+    def _commands(state: SimState, owners, *ids) -> tuple:
+        return (np.asarray(owners, dtype=np.int64), *(state.rows_of(unit_ids) for unit_ids in ids))
+
+    @staticmethod
+    def _first(rows: np.ndarray) -> np.ndarray:
+        """Whether each command is the first one for its unit, a unit can only act once a part"""
+        first = np.zeros(len(rows), dtype=bool)
+        first[np.unique(rows, return_index=True)[1]] = True
+        return first
@@ -0,0 +1,20 @@
+import socket
+
+
+def connect(address: str) -> socket.socket:
+    """
+    Connect to the game at the address it passed as the bot's first argument.
+
+    - `unix:<path>` connects to a Unix domain socket
+    - `fd:<n>` uses a socket inherited from the game, which is already connected
+    - anything else is a TCP port on localhost
+    """
+    if address.startswith("unix:"):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(address[len("unix:"):])
+    elif address.startswith("fd:"):
+        sock = socket.socket(fileno=int(address[len("fd:"):]))
+    else:
+        sock = socket.socket()
+        sock.connect(('localhost', int(address)))
+    return sock
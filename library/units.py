@@ -6,7 +6,6 @@ from collections import deque
 from dataclasses import dataclass, field
 from typing import List, Callable, Optional, Union
 
-from library.utils import raycast
 
 
 @dataclass(init=True, repr=True)
@@ -52,11 +51,11 @@ class Unit:  # use dataclass?
             diff = self.speed / dist * diff
             self.queued_moves.append(npos)
 
-        for step in raycast(self.position, self.position + diff):
-            if self.bot.map[tuple(step)] == 1:
-                raise RuntimeError(f"{self} attempted invalid move to or through impassable tile {self}")
+        end = (self.position + diff).astype(int)
+        if not self.bot.passability.is_clear(self.position, end):
+            raise RuntimeError(f"{self} attempted invalid move to or through impassable tile {self}")
 
-        self.position = (self.position + diff).astype(int)
+        self.position = end
         self.bot.send(dict(command='move', unit=self.id, destination=npos.tolist()))
 
     def proceed(self) -> None:
@@ -64,6 +63,14 @@ class Unit:  # use dataclass?
         if self.queued_moves:
             self.move(self.queued_moves.pop(), new=False)
 
+    def move_toward(self, destination) -> None:
+        """Move as far as possible along the shortest path to the destination, around impassable tiles.
+        Meant for fixed destinations like resource nodes and homes, whose flow fields are cached for the match.
+        Bot.move_toward moves many units at once."""
+        waypoint = self.bot.pathfinder.next_waypoints(self.position, destination, self.speed)[0]
+        if tuple(waypoint) != tuple(self.position):
+            self.move(waypoint)
+
     def dist_to(self, other: 'Unit'):
         return np.hypot(*(np.array(self.position) - np.array(other.position)))
 
@@ -93,13 +100,11 @@ class Unit:  # use dataclass?
         target.health -= self.attack
         self.bot.send(dict(command='attack', unit=self.id, target=target.id))
 
-    def nearest_nodes(self):
-        nodes = (
-            np.argwhere(
-                (self.bot.map == 3) | (self.bot.map == 4)
-            )
-        )
-        yield from sorted(nodes, key=lambda index: np.linalg.norm(self.position - index))
+    def nearest_nodes(self, resource: Union[int, str] = None, unclaimed: bool = False):
+        """Positions of the resource nodes, optionally of one resource or only unclaimed ones, nearest first"""
+        resources = self.bot.resources
+        order = resources.nearest(self.position, len(resources), resource, unclaimed)[0]
+        yield from resources.nodes[order[order >= 0]]
 
     def collect(self):
         if self.bot.map[tuple(self.position)] not in (3, 4):
@@ -178,9 +183,8 @@ class Group:
             diff = self.speed / dist * diff
             self.queued_moves.insert(0, npos)
 
-        for step in raycast(self.position, self.position + diff):
-            if self.bot.map[tuple(step)] == 1:
-                raise RuntimeError(f"{self} attempted invalid move to or through impassable tile {self}")
+        if not self.bot.passability.is_clear(self.position, (self.position + diff).astype(int)):
+            raise RuntimeError(f"{self} attempted invalid move to or through impassable tile {self}")
 
         for unit in self.members:
             unit.move((npos + diff).astype(int))
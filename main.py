@@ -1,9 +1,11 @@
 import sys
+import time
 
 from games.aigame.game import AIGame
 
 game = AIGame(
     ["example_bot2.py"] * 2,
+    metrics_path=f"metrics-{time.time()}",  # Only written with ENABLE_PROFILER=1
 )
 game.run()
 print("ITS OVER")
@@ -0,0 +1,50 @@
+"""How a library bot reconciles its units with the part_start states the game sends"""
+import numpy as np
+
+from games.aigame.benchmark import IdleBot
+from games.aigame.game import AIGame
+
+
+class DeltaBot(IdleBot):
+    delta = True
+
+    def on_part_start_raw(self, payload):
+        self.deltas = getattr(self, 'deltas', []) + [payload.get('delta', False)]
+        super().on_part_start_raw(payload)
+
+
+def send_part(game, turn, part):
+    game.players[0].send_part_start(turn, part, game.get_part_state(turn, part))
+
+
+def test_full_then_delta_part_start():
+    game = AIGame([DeltaBot, IdleBot], map_seed=1, record_replay=False)
+    game.init_game()
+    bot = game.players[0].bot
+    stays, moves, predicted = (game.create_unit(game.players[0], unit_type) for unit_type in ("gatherer",) * 3)
+    enemy = game.create_unit(game.players[1], "attacker")
+    stays.position, moves.position, predicted.position = (20, 20), (30, 30), (40, 40)
+
+    send_part(game, 0, "attack")
+    assert bot.spawned == {stays.id, moves.id, predicted.id, enemy.id}
+    assert bot.moved == set()
+    known = {unit.id: unit for unit in bot.units}
+    known[stays.id].role = "scout"
+
+    # The bot predicts moves locally, the game only carries out two of them
+    bot.part = "move"
+    known[stays.id].move((25, 20))
+    known[predicted.id].move((45, 40))
+    moves.position = (35, 30)
+    predicted.position = (45, 40)
+
+    send_part(game, 0, "move")
+    assert bot.deltas == [False, True]
+    assert sorted(unit.id for unit in bot.units) == sorted(known)
+    assert all(unit is known[unit.id] for unit in bot.units)
+    assert known[stays.id].role == "scout"
+    # Moved compares with the positions the game sent last time, not with the bot's predictions
+    assert bot.moved == {moves.id, predicted.id}
+    for unit in (stays, moves, predicted, enemy):
+        assert np.array_equal(known[unit.id].position, unit.position)
+    game.close()
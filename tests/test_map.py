@@ -0,0 +1,56 @@
+"""Map generation and the on-disk map cache"""
+import hashlib
+
+import numpy as np
+import pytest
+
+from games.aigame import map as maps
+from games.aigame.benchmark import IdleBot
+from games.aigame.game import AIGame
+from games.aigame.map import MAP_VERSION, generate_map, load_map
+
+# Digest of the map of each seed for the current MAP_VERSION. If generation changes on purpose,
+# bump MAP_VERSION and update these.
+LAYOUTS = {
+    2: {1: "93ecae4133a814b3ff9826205e5179cf72e1c7a2", 2: "3ecdbe878b81734da7bb82a6dbdacdd42cb56e06"},
+}
+
+
+def digest(tiles: np.ndarray) -> str:
+    return hashlib.sha1(np.ascontiguousarray(tiles, dtype=np.int8).tobytes()).hexdigest()
+
+
+def test_same_seed_same_map():
+    assert np.array_equal(generate_map(5), generate_map(5))
+    assert not np.array_equal(generate_map(5), generate_map(6))
+
+
+def test_layout_is_pinned_to_map_version():
+    assert MAP_VERSION in LAYOUTS, "Generation changed, record the layouts of the new MAP_VERSION"
+    for seed, expected in LAYOUTS[MAP_VERSION].items():
+        assert digest(generate_map(seed)) == expected, f"Map of seed {seed} changed without a MAP_VERSION bump"
+
+
+def test_cached_map_matches_generated(tmp_path):
+    first = load_map(3, str(tmp_path))
+    again = load_map(3, str(tmp_path))
+    assert np.array_equal(first, generate_map(3))
+    assert np.array_equal(again, first)
+    assert [path.name for path in tmp_path.iterdir()] == [f"map-v{MAP_VERSION}-3.npy"]
+
+
+def test_failed_cache_write_leaves_no_file(tmp_path, monkeypatch):
+    def fail(seed, **params):
+        raise MemoryError
+
+    monkeypatch.setattr(maps, "generate_map", fail)
+    with pytest.raises(MemoryError):
+        load_map(3, str(tmp_path))
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_map_cache_read_when_the_game_is_created(tmp_path, monkeypatch):
+    monkeypatch.setenv("MAP_CACHE_DIR", str(tmp_path))
+    game = AIGame([IdleBot, IdleBot], record_replay=False)
+    assert game.map_cache == str(tmp_path)
+    game.close()
@@ -0,0 +1,18 @@
+"""Whole matches between the example bots, played in-process"""
+import pytest
+
+import example_bot
+import example_bot2
+from games.aigame.game import AIGame, ROUND_COUNT
+
+
+@pytest.mark.parametrize("bot", [example_bot2.AIBot, example_bot.AIBot])
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_example_bots_finish(bot, seed):
+    game = AIGame([bot, bot], map_seed=seed, record_replay=False)
+    game.run()
+
+    results = game.results()
+    assert results['rounds'] == ROUND_COUNT
+    assert results['winner'] in (0, 1)
+    assert all(amount >= 0 for balance in results['balances'].values() for amount in balance.values())
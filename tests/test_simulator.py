@@ -0,0 +1,65 @@
+"""The bot library's Simulator against the engine, from the same state and with the same commands"""
+from collections import Counter
+
+import numpy as np
+
+import example_bot
+import example_bot2
+from games.aigame.game import AIGame
+from library.protocol import PARTS, RESOURCES
+from library.simulator import Simulator, SimState
+
+ROUNDS = 60
+
+
+def balances(game: AIGame) -> np.ndarray:
+    return np.array([[player.balance[name] for name in RESOURCES] for player in game.players], dtype=np.int64)
+
+
+def assert_same(game: AIGame, state: SimState, where: str):
+    assert np.array_equal(game.store.records(), state.units), f"Units differ after {where}"
+    assert np.array_equal(balances(game), state.balances), f"Balances differ after {where}"
+
+
+def test_simulator_follows_engine(monkeypatch):
+    game = AIGame([example_bot2.AIBot, example_bot.AIBot], map_seed=2, record_replay=False)
+    game.init_game()
+    simulator = Simulator(game.map, game.costs, game.unit_stats, game.store.type_names,
+                          {player.player_id: player.home for player in game.players}, game.passability)
+    # One state rolled forward alongside the game for the whole test, never resynced from it
+    state = SimState(game.store.records(), balances(game), game.unit_counter)
+    played = Counter()
+
+    start_round, finish_part = game.round.start_round, game.round.finish_part
+
+    def start_both_rounds(round_number):
+        start_round(round_number)
+        simulator.start_round(state)
+        assert_same(game, state, f"the start of round {round_number}")
+
+    def finish_both_parts(round_number, part):
+        commands = {player.player_id: list(player.action_buffer[game.turn][part]) for player in game.players}
+        finish_part(round_number, part)
+        simulator.play_part(state, part, commands)
+        played[part] += sum(map(len, commands.values()))
+        assert_same(game, state, f"{part} of round {round_number}")
+
+    monkeypatch.setattr(game.round, "start_round", start_both_rounds)
+    monkeypatch.setattr(game.round, "finish_part", finish_both_parts)
+    for game.turn in range(ROUNDS):
+        game.step(game.turn)
+    game.close()
+    assert all(played[part] for part in PARTS), played
+
+
+def test_commands_on_empty_state():
+    game = AIGame([example_bot2.AIBot, example_bot.AIBot], map_seed=2, record_replay=False)
+    game.init_game()
+    simulator = Simulator(game.map, game.costs, game.unit_stats, game.store.type_names,
+                          {player.player_id: player.home for player in game.players}, game.passability)
+    state = SimState(game.store.records()[:0], balances(game))
+
+    assert not simulator.attack(state, [0], [1], [2]).any()
+    assert not simulator.move(state, [0], [1], [[3, 3]]).any()
+    assert not simulator.collect(state, [0], [1]).any()
+    assert np.array_equal(state.rows_of([0, 1]), [-1, -1])
@@ -0,0 +1,24 @@
+import argparse
+import json
+
+from games.aigame.server import TRANSPORTS
+from games.aigame.tournament import schedule, run_tournament, MATCH_TIMEOUT
+
+parser = argparse.ArgumentParser(description="Play every pair of bots against each other across a process pool")
+parser.add_argument("bots", nargs="+", help="Bot file paths")
+parser.add_argument("--games", type=int, default=2, help="Matches per pairing, seats rotate between them")
+parser.add_argument("--players", type=int, default=2, help="Bots per match")
+parser.add_argument("--workers", type=int, default=None, help="Matches run at once, defaults to the CPU count")
+parser.add_argument("--timeout", type=int, default=MATCH_TIMEOUT, help="Seconds before a match is stopped")
+parser.add_argument("--replays", default="replays", help="Directory for match replays")
+parser.add_argument("--logs", default=None, help="Directory for match logs, discarded when not given")
+parser.add_argument("--transport", default="tcp", choices=TRANSPORTS,
+                    help="How bots connect, unix and socketpair avoid TCP but only work with library bots")
+parser.add_argument("--output", default="tournament.json", help="Where to write the results")
+args = parser.parse_args()
+
+matches = schedule(args.bots, args.games, args.players)
+results = run_tournament(matches, args.workers, args.timeout, args.replays, args.logs, args.transport)
+with open(args.output, 'w') as outfile:
+    json.dump(results, outfile, indent=2)
+print(json.dumps(results['summary'], indent=2))